@@ -3,13 +3,92 @@
 # A pared-down module containing some functions commonly used
 # to manipulate files containing education data.
 
+import re, csv
+
+# a line whose fields are each either wholly quoted (with the
+# one kind of quote, and no doubled quotes inside) or not quoted
+# at all means the same to extract_fields as to the csv module
+_DOUBLE_QUOTED = re.compile(r'(?:"[^"\r\n]*"|[^,"\r\n]*)(?:,(?:"[^"\r\n]*"|[^,"\r\n]*))*')
+_SINGLE_QUOTED = re.compile(r"(?:'[^'\r\n]*'|[^,'\r\n]*)(?:,(?:'[^'\r\n]*'|[^,'\r\n]*))*")
+_QUOTE         = re.compile('["\']')
+
 def extract_fields(line):
   """Return a list of the entries in each line.
 
-  WARNING: this function is elegant, but doesn't deal well
-  with field entries that themselves include commas, e.g.
-  'Washington, D.C.' will cause this function to split into
-  'Washington' and 'D.C.'.
+  Fields are separated by commas, except for commas inside
+  a quoted string.  Either double or single quotes may be
+  used, the other kind being kept as an ordinary character
+  inside the string; the quotes themselves are dropped,
+  wherever they are in a field.  An empty last field is left
+  off, and any newline at the end stays on the last field.
+
+  The work is done by str.split when there are no quotes,
+  and by the csv module's tokenizer for ordinary quoted
+  fields, falling back to _extract_fields_by_quote for
+  anything stranger, or for a field too big for the csv
+  module (see csv.field_size_limit).  The results are always
+  the same as the original, _extract_fields_by_char.
+  """
+  
+  if '"' not in line and "'" not in line:
+    fields = line.split(',')
+  else:
+    body = line.rstrip('\r\n')
+    try:
+      if "'" not in body and _DOUBLE_QUOTED.fullmatch(body):
+        fields = next(csv.reader((body,)))
+      elif '"' not in body and _SINGLE_QUOTED.fullmatch(body):
+        fields = next(csv.reader((body,), quotechar="'"))
+      else:
+        return _extract_fields_by_quote(line)
+    except csv.Error:
+      return _extract_fields_by_quote(line)
+    fields = fields or ['']
+    fields[-1] += line[len(body):]      # put back the newline
+  
+  if not fields[-1]:
+    fields.pop()                        # no empty last field
+  return fields
+
+def _extract_fields_by_quote(line):
+  """Return a list of the entries in each line, parsing a quoted string at a time.
+
+  Splits the text between quoted strings on commas, and
+  finds the end of each quoted string with str.find.
+  """
+  
+  fields = []
+  field  = ""
+  pos    = 0
+  while True:
+    quote  = _QUOTE.search(line, pos)
+    end    = quote.start() if quote else len(line)
+    pieces = line[pos:end].split(',')   # unquoted text up to the next quote
+    if len(pieces) > 1:
+      fields.append(field + pieces[0])
+      fields.extend(pieces[1:-1])
+      field = pieces[-1]
+    else:
+      field += pieces[0]
+    if quote is None:
+      break
+    close = line.find(quote.group(), end + 1)
+    if close == -1:                     # quoted string runs to the end of the line
+      field += line[end+1:]
+      break
+    field += line[end+1:close]
+    pos    = close + 1
+  
+  if field:
+    fields.append(field)  # adding the last field
+  
+  return fields
+
+def _extract_fields_by_char(line):
+  """Return a list of the entries in each line, parsing a character at a time.
+
+  This is the original, slow version of extract_fields, kept
+  as the reference that extract_fields must agree with.
   """
   
   fields = []
@@ -40,57 +119,322 @@ def extract_fields(line):
   return fields
 
 
-import os
+import os, io, json, itertools
+import sys, gzip, bz2, lzma, threading, queue
+try:
+  import zstandard
+except ImportError:
+  zstandard = None
+
+# leading bytes of each kind of compressed file, and the
+# file name extensions used to ask for compressed output
+_MAGIC    = [(b'\x1f\x8b', 'gzip'), (b'BZh', 'bz2'),
+             (b'\xfd7zXZ\x00', 'xz'), (b'\x28\xb5\x2f\xfd', 'zstd')]
+_SUFFIXES = {'.gz': 'gzip', '.bz2': 'bz2', '.xz': 'xz', '.zst': 'zstd'}
+
+def compression(filename):
+  """Return the kind of compression of a file ('gzip', 'bz2', 'xz' or 'zstd'), or None.
+
+  This goes by the first few bytes of the file, not its name.
+  """
+  
+  with open(filename, 'rb') as cfile:
+    start = cfile.read(6)
+  for magic, kind in _MAGIC:
+    if start.startswith(magic):
+      return kind
+  return None
+
+def _plain_name(filename):
+  """Return a file name without its compression extension, if any: 'out.csv.gz' gives 'out.csv'."""
+  
+  basename, ext = os.path.splitext(filename)
+  return basename if ext in _SUFFIXES else filename
+
+def _split_ext(filename):
+  """Split a file name like os.path.splitext, keeping a compression extension with the one before it.
+
+  So 'out.csv.gz' gives ('out', '.csv.gz').
+  """
+  
+  basename, ext = os.path.splitext(_plain_name(filename))
+  return basename, ext + filename[len(_plain_name(filename)):]
+
+def _require_uncompressed(filename):
+  """Raise ValueError if a file is compressed, for things that need byte offsets into it."""
+  
+  if compression(filename) is not None:
+    raise ValueError("{0} is compressed; byte offsets need an uncompressed file".format(filename))
+
+def _zstandard():
+  if zstandard is None:
+    raise ValueError("reading or writing zstd files needs the zstandard package")
+  return zstandard
+
+class _ThreadedReader(io.RawIOBase):
+  """A binary file read ahead by a separate thread, block by block.
+
+  zlib, bz2 and lzma let other threads run while they decompress,
+  so decompressing in a thread of its own overlaps with parsing
+  what has already come out.
+  """
+  
+  def __init__(self, source, blocksize=1 << 20, blocks=4):
+    self._source = source
+    self._blocks = queue.Queue(blocks)
+    self._block  = memoryview(b'')
+    self._done   = False
+    self._stop   = False
+    self._thread = threading.Thread(target=self._fill, args=(blocksize,), daemon=True)
+    self._thread.start()
+  
+  def _fill(self, blocksize):
+    try:
+      while not self._stop:
+        block = self._source.read(blocksize)
+        self._blocks.put(block)
+        if not block:
+          break
+    except Exception as e:
+      self._blocks.put(e)
+  
+  def readable(self):
+    return True
+  
+  def readinto(self, buffer):
+    while not self._block and not self._done:
+      block = self._blocks.get()
+      if isinstance(block, Exception):
+        self._done = True
+        raise block
+      if not block:
+        self._done = True
+      self._block = memoryview(block)
+    n = min(len(buffer), len(self._block))
+    buffer[:n] = self._block[:n]
+    self._block = self._block[n:]
+    return n
+  
+  def close(self):
+    # at interpreter exit the thread may be frozen part way
+    # through a read, so the source is left for the OS to close
+    if not self.closed and not sys.is_finalizing():
+      # stop the thread, making room for it if it's waiting for some
+      self._done = self._stop = True
+      while self._thread.is_alive():
+        try:
+          self._blocks.get(timeout=0.1)
+        except queue.Empty:
+          pass
+      self._source.close()
+    super().close()
+
+def open_file(filename, mode='r', threaded=False, **kwargs):
+  """Open a file that may be compressed, just as open() would.
+
+  Reading, compressed files (gzip, bz2, xz, and zstd if the
+  zstandard package is installed) are found by their first few
+  bytes and decompressed as a stream, so they never need to be
+  decompressed to disk first.  With threaded = True that is done
+  in a separate thread, overlapping with whatever reads the file.
+
+  Writing, the compression is chosen by the file name's extension
+  ('.gz', '.bz2', '.xz' or '.zst'); any other name is written
+  uncompressed.
+
+  mode is 'r', 'rb', 'w' or 'wb' (with an optional 't'); other
+  keyword arguments (encoding, newline, buffering) are passed on
+  to open() or to the text wrapper around the (de)compressor.
+  """
+  
+  binary = 'b' in mode
+  mode   = mode.replace('t', '').replace('b', '')
+  if mode == 'r':
+    kind = compression(filename)
+  else:
+    kind = _SUFFIXES.get(os.path.splitext(filename)[1])
+  if kind is None:
+    return open(filename, mode + ('b' if binary else ''), **kwargs)
+  
+  buffering = kwargs.pop('buffering', -1)
+  if kind == 'gzip':
+    cfile = gzip.open(filename, mode + 'b')
+  elif kind == 'bz2':
+    cfile = bz2.open(filename, mode + 'b')
+  elif kind == 'xz':
+    cfile = lzma.open(filename, mode + 'b')
+  elif mode == 'r':
+    cfile = _zstandard().ZstdDecompressor().stream_reader(open(filename, 'rb'), closefd=True)
+  else:
+    cfile = _zstandard().ZstdCompressor().stream_writer(open(filename, 'wb'), closefd=True)
+  
+  if mode == 'r':
+    if threaded:
+      cfile = _ThreadedReader(cfile)
+    cfile = io.BufferedReader(cfile, buffering if buffering > 1 else io.DEFAULT_BUFFER_SIZE)
+  elif buffering > 1:
+    cfile = io.BufferedWriter(cfile, buffering)
+  return cfile if binary else io.TextIOWrapper(cfile, **kwargs)
+
+def _first_field(line):
+  """Return extract_fields(line)[0], without parsing the rest of the line."""
+  
+  head = line.partition(',')[0]
+  if '"' in head or "'" in head:        # a quote could hide the first comma
+    return extract_fields(line)[0]
+  return head
+
+def _index_filename(infilename):
+  """Return the name of the sidecar index file kept next to a data file."""
+  
+  return infilename + '.idx'
+
+def _load_sidecar(infilename):
+  """Return the saved sidecar index for a file, or an empty one if it's missing or stale.
+
+  The sidecar is a JSON dict holding the data file's size and
+  modification time when it was written, plus whichever indexes
+  have been built: a line index (see build_line_index) and any
+  column indexes (see build_column_index).
+  """
+  
+  stat  = os.stat(infilename)
+  fresh = {'size': stat.st_size, 'mtime': stat.st_mtime}
+  try:
+    with open(_index_filename(infilename), 'r') as xfile:
+      sidecar = json.load(xfile)
+  except (OSError, ValueError):
+    return fresh
+  
+  if sidecar.get('size') != stat.st_size or sidecar.get('mtime') != stat.st_mtime:
+    return fresh                        # the data file has changed since
+  return sidecar
+
+def _save_sidecar(infilename, sidecar):
+  """Write the sidecar index for a file."""
+  
+  with open(_index_filename(infilename), 'w') as xfile:
+    json.dump(sidecar, xfile)
+
+def build_line_index(infilename, stride=1000):
+  """Record where every "stride"-th line of a file starts, and save it.
+
+  The index is a dict holding (among other things)
+      {'size', 'mtime', 'stride', 'lines', 'offsets'},
+  where offsets[k] is the byte offset of line number k*stride
+  and lines is the number of lines in the file.  It is saved
+  as JSON in a sidecar file next to the data file (the data
+  file's name plus '.idx'), along with the data file's size
+  and modification time, so that a stale index is never used.
+
+  Lines are taken to end with '\n' (or '\r\n').
+  """
+  
+  _require_uncompressed(infilename)
+  sidecar = _load_sidecar(infilename)
+  offsets = []
+  offset  = 0
+  lines   = 0
+  with open(infilename, 'rb') as ifile:
+    for lines, line in enumerate(ifile, 1):
+      if (lines - 1) % stride == 0:
+        offsets.append(offset)
+      offset += len(line)
+  
+  sidecar['stride']  = stride
+  sidecar['lines']   = lines
+  sidecar['offsets'] = offsets
+  _save_sidecar(infilename, sidecar)
+  return sidecar
+
+def load_line_index(infilename):
+  """Return the saved line index for a file, or None if there isn't a current one."""
+  
+  sidecar = _load_sidecar(infilename)
+  return sidecar if 'offsets' in sidecar else None
+
+def get_line_index(infilename, stride=1000):
+  """Return the saved line index for a file, building it first if need be."""
+  
+  index = load_line_index(infilename)
+  if index is None:
+    index = build_line_index(infilename, stride)
+  return index
+
+def line_offset(index, lineno):
+  """Find the nearest indexed line at or before a line number.
+
+  Returns a tuple (line number, byte offset) for that line,
+  from which the file can be read forwards to "lineno".
+  """
+  
+  k = min(max(lineno, 0) // index['stride'], len(index['offsets']) - 1)
+  if k < 0:
+    return 0, 0                         # empty file
+  return k * index['stride'], index['offsets'][k]
 
-def extract_chunk(infilename, outfilename, begin, end, period = None):
+def extract_chunk(infilename, outfilename, begin, end, period = None, index = False, threaded = False):
   """Extract a group of lines from input file and write to output file.
 
   Extract a contiguous sequence of lines, starting with
   line number "begin" and ending with line number "end".
   If this will produce an inordinately large output file,
   the user can break it into sections of length "period".
+  A section is only ever broken between rows with different
+  first fields, so that one student's rows stay together
+  (as long as they're next to each other: sort_csv can see
+  to that for a file that isn't in order).
+
+  With index = True, a sidecar line index (see build_line_index)
+  is used to jump near line "begin" instead of reading every
+  line before it; the index is built first if there isn't an
+  up-to-date one.  A compressed input file (see open_file) can't
+  be jumped into, so it is always read from the start.
+
+  An outfilename ending in '.gz', '.bz2', '.xz' or '.zst' gives
+  compressed output files, e.g. out000.csv.gz, out001.csv.gz.
   """
 
-  # open input file
-  ifile = open( infilename, 'r')  # open file for reading
+  # open input file, skipping ahead if we have an index
+  i = 0
+  rawfile = open_file(infilename, 'rb', threaded=threaded)   # open file for reading
+  if index and compression(infilename) is None:
+    i, offset = line_offset(get_line_index(infilename), begin)
+    rawfile.seek(offset)
+  ifile = io.TextIOWrapper(rawfile)   # read text just as open(infilename, 'r') would
   
   # prepare for a sequence of output files
   # remove outfilename extension, insert file iteration number,
   # reattach extension
   iter = 0
-  basename, ext  = os.path.splitext(outfilename)
+  basename, ext  = _split_ext(outfilename)
   newoutfilename = "{0}{1:0=3}{2}".format(basename, iter, ext)
-  ofile          = open(newoutfilename, 'w')  # open file for writing
+  ofile          = open_file(newoutfilename, 'w', buffering=1 << 20)  # open file for writing
   
   # go through lines in ifile
   # write those in desired range to ofile
   # but if you've written "period" lines
   # write to a new ofile
-  i     = 0
-  count = 0
+  # (lines skipped before "begin" count towards the first "period")
+  first = max(begin, i)
+  count = first
   last  = None
-  for line in ifile:
-    if begin <= i <= end:
-      data = extract_fields(line)
-      if data[0] != last and (period != None and count >= period):
-        ofile.close()
-        count = 0
-        iter += 1
-        newoutfilename = "{0}{1:0=3}{2}".format(basename, iter, ext)
-        ofile = open(newoutfilename, 'w')
-      ofile.write(line)
-      last  = data[0]
-    elif end < i:
-      break
-    i += 1
+  for line in itertools.islice(ifile, first - i, max(end + 1 - i, first - i)):
+    data0 = _first_field(line)        # only the first field is needed
+    if data0 != last and (period != None and count >= period):
+      ofile.close()
+      count = 0
+      iter += 1
+      newoutfilename = "{0}{1:0=3}{2}".format(basename, iter, ext)
+      ofile = open_file(newoutfilename, 'w', buffering=1 << 20)
+    ofile.write(line)
+    last  = data0
     count += 1
   
   # close files
   ifile.close(); ofile.close()
 
-import sys, csv
-
-def get_headers(infilename, headfilename=None):
+def get_headers(infilename, headfilename=None, threaded=False):
     """Get column names.
 
     This function plucks out the names of columns in a CSV file
@@ -101,23 +445,27 @@ def get_headers(infilename, headfilename=None):
         (headers, ifile),
     where headers is a list of column titles, and ifile is a
     csv file object containing the input file.
+
+    Either file may be compressed (see open_file); with
+    threaded = True the input file is decompressed in a
+    separate thread.
     """
     
     # open input file & header file (if different)
-    ifile = csv.reader(open(  infilename, 'r'))  # open file for reading
+    ifile = csv.reader(open_file(infilename, 'r', threaded=threaded))  # open file for reading
     if headfilename:
-        hbasename, hext = os.path.splitext(headfilename)
+        hbasename, hext = os.path.splitext(_plain_name(headfilename))
     
     # get the column headers
     # from this file or a separate file
     headers = []
     if headfilename:
         if hext == '.csv':
-            hfile    = csv.reader(open(headfilename, 'r'))  # open file for reading
+            hfile    = csv.reader(open_file(headfilename, 'r'))  # open file for reading
             for line in hfile:
                 headers += line                   # column headers may be spread over several lines
         else:
-            hfile = open(headfilename, 'r')
+            hfile = open_file(headfilename, 'r')
             for line in hfile:
                 headers += extract_fields(line)
             hfile.close()
@@ -136,64 +484,159 @@ def get_headers(infilename, headfilename=None):
     return headers, ifile
 
 
+class HeaderSchema:
+  """Column positions for the headers of a CSV file.
+
+  Build one of these once per file from the headers returned
+  by get_headers.  Looking up a named column is then a dict
+  lookup done before reading any rows, and each row is read
+  with a plain list index instead of searching the list of
+  headers for every field.
+
+  Asking for a column that isn't there raises a ValueError,
+  the same as headers.index() would, but naming every missing
+  column and listing the headers that do exist.
+  """
+
+  def __init__(self, headers):
+    self.headers   = list(headers)
+    self.positions = {}
+    for i, title in enumerate(self.headers):
+      self.positions.setdefault(title, i)   # like headers.index(), first match wins
+
+  def __len__(self):
+    return len(self.headers)
+
+  def __contains__(self, title):
+    return title in self.positions
+
+  def index(self, title):
+    """Return the position of a single column."""
+    return self.require(title)[0]
+
+  def require(self, *titles):
+    """Return the positions of several columns, failing if any are missing."""
+    missing = [title for title in titles if title not in self.positions]
+    if missing:
+      raise ValueError("{0} not in column headers...\n\tHeaders:{1}".format(
+        ", ".join(missing), self.headers))
+    return [self.positions[title] for title in titles]
+
+  def matching(self, text):
+    """Return the positions of all columns whose title contains text."""
+    return [i for i, title in enumerate(self.headers) if text in title]
+
+
+def not_blank(value):
+  """A test for the "where" argument of read_csv_rows: the field isn't empty."""
+  return value != ''
+
+def _select_rows(rows, schema, columns, where, types):
+  """Iterate over the rows passing every "where" test, keeping only "columns".
+
+  See read_csv_rows.
+  """
+  
+  positions = schema.require(*columns)
+  
+  # each test is a function of the stripped field;
+  # a plain value means the field must equal it
+  tests = []
+  for title, test in (where or {}).items():
+    if not callable(test):
+      test = str(test).__eq__
+    tests.append((schema.index(title), test))
+  
+  types      = types or {}
+  converters = [(k, types[title]) for k, title in enumerate(columns) if title in types]
+  
+  for row in rows:
+    for position, test in tests:          # rows are thrown out before any other work
+      if not test(row[position].strip()):
+        break
+    else:
+      values = [row[position] for position in positions]
+      for k, convert in converters:
+        values[k] = convert(values[k])
+      yield values
+
+def read_csv_rows(infilename, headfilename=None, columns=None, where=None, types=None, threaded=False):
+  """Iterate over some of the rows and columns of a CSV file.
+
+  Yields one list of values per row, holding just the fields
+  named in "columns" (all of them by default), in that order.
+
+  "where" is a dict of tests a row must pass to be kept, each
+  applied to the column's field with whitespace stripped.  A
+  test is either a value the field must equal, or a function
+  returning True for fields to keep, e.g.
+      where={'year': 2007, 'm_raw': not_blank}
+  Rows are tested before any of their fields are copied or
+  converted.
+
+  "types" is a dict of functions to convert the fields of some
+  columns with, e.g. types={'m_raw': float}.  Fields are
+  strings otherwise, just as csv.reader gives them.
+
+  The file may be compressed, and threaded is as for get_headers.
+  """
+  
+  headers, ifile = get_headers(infilename, headfilename, threaded)
+  schema         = HeaderSchema(headers)
+  if columns is None:
+    columns = headers
+  return _select_rows(ifile, schema, list(columns), where, types)
 
-def get_csv_columns(infilename, headfilename=None):
+def get_csv_columns(infilename, headfilename=None, columns=None, where=None, types=None, threaded=False):
   """Take data from CSV file and read into a dict of columns.
 
   Column headers become the dictionary keys and are read
   from the first line of the input file, unless a header
   file is specified, in which case the column names are
   read from the header.
+
+  To read only part of the file, "columns", "where" and
+  "types" work as for read_csv_rows.  The headers returned
+  are then just those in "columns".
+
+  The file may be compressed, and threaded is as for get_headers.
   """
   
-  # open input file & header file (if different)
-  ifile           = csv.reader(open(  infilename, 'r'))  # open file for reading
-  hbasename, hext = os.path.splitext(headfilename)
-  
-  # get the column headers
-  # from this file or a separate file
-  headers = []
-  if headfilename:
-    if hext == '.csv':
-      hfile    = csv.reader(open(headfilename, 'r'))  # open file for reading
-      for line in hfile:
-        headers += line                   # column headers may be spread over several lines
-    else:
-      hfile = open(headfilename, 'r')
-      for line in hfile:
-        headers += extract_fields(line)
-      hfile.close()
-  else:
-    for line in ifile:
-      headers += line
-      break                             # should only have header in first line
+  headers, ifile = get_headers(infilename, headfilename, threaded)
+  schema         = HeaderSchema(headers)
   
-  # get rid of leading and trailing whitespace (including newlines)
-  # in each column label
-  for i in range(len(headers)):
-    headers[i] = headers[i].strip()                # in case headers are split over multiple lines
-  if '' in headers:
-    headers.pop(headers.index(''))
+  if columns is not None or where is not None or types is not None:
+    headers = list(columns) if columns is not None else headers
+    data    = dict((title, []) for title in headers)
+    appends = [data[title].append for title in headers]
+    for values in _select_rows(ifile, schema, headers, where, types):
+      for append, value in zip(appends, values):
+        append(value)
+    return headers, data
   
   data = {}
   for title in headers:
     data[title] = []
   
+  # pair each column's list with the position of its field,
+  # so each row is just a run of list indexes and appends
+  columns = [(data[title].append, i) for i, title in enumerate(schema.headers)]
+  
   # when we use "line" iterator in ifile again,
   # it should be at the point where we left off, i.e.
   # the 1st line if there's a separate header file, or
   # the 2nd line if the header's in the same file
-  for line in ifile:                        # should now be first line of data
-    values = line
-    for i in range(len(headers)):
-      data[headers[i]].append(values[i])
+  for values in ifile:                      # should now be first line of data
+    for append, i in columns:
+      append(values[i])
   
   # returning both headers (list) and data (dict)
   # allows user to maintain column order using
   # the order of strings in headers list
   return headers, data
 
-def extract_sequential(groupfield, seqfield, infilename, headfilename=None):
+def extract_sequential(groupfield, seqfield, infilename, headfilename=None, outfilename=None, threaded=False,
+                       sort=False, memory=None):
   """From a CSV file, extract rows sequentially that share a common property.
 
   The usage of this function is best illustrated by an
@@ -211,60 +654,895 @@ def extract_sequential(groupfield, seqfield, infilename, headfilename=None):
   data regarding that student from the output.  The
   property name "DISADV" is the "seqfield" we would
   input to the function.
+
+  This is done in a single pass, holding only the rows of
+  one group at a time, so the rows for each group must be
+  contiguous in the input file.  As it always has, the last
+  group in the file is written out without being checked.
+  With sort = True the rows are first sorted by groupfield
+  (see sorted_rows, which "memory" is passed to), so they
+  can come in any order; the groups are then written out in
+  order of groupfield.
+
+  The output goes to outfilename, by default the input file's
+  name plus '_seq' before the extension (before both, for a
+  name like TAKS.csv.gz); a name ending in '.gz', '.bz2', '.xz'
+  or '.zst' gives compressed output (see open_file).  It is
+  written in batches by a RowWriter, so it only appears once
+  it's complete.  The input may be compressed, and threaded is
+  as for get_headers.
   """
   
   # open input file & prepare output file
   # with same name, plus 'seq' before the extension
-  basename, ext  = os.path.splitext(infilename)
-  outfilename    = "{0}_{1}{2}".format(basename, 'seq', ext)
-  ofile          = csv.writer(open( outfilename, 'w'))  # open file for writing
+  if outfilename is None:
+    basename, ext  = _split_ext(infilename)
+    outfilename    = "{0}_{1}{2}".format(basename, 'seq', ext)
   
-  headers, data = get_csv_columns(infilename, headfilename)
+  headers, ifile = get_headers(infilename, headfilename, threaded)
+  schema         = HeaderSchema(headers)
   
-  if groupfield not in data.keys():
+  if groupfield not in schema:
     print("Error: {0} not in column headers...".format(groupfield))
     print("\tHeaders:{0}".format(headers))
     sys.exit(1)
-  elif seqfield not in data.keys():
+  elif seqfield not in schema:
     print("Error: {0} not in column headers...".format(seqfield))
     print("\tHeaders:{0}".format(headers))
     sys.exit(1)
-  else:
+  
+  groupcol, seqcol = schema.require(groupfield, seqfield)
+  width            = len(headers)       # any fields past the last header are dropped
+  
+  # Output to file
+  # write the headers
+  with RowWriter(outfilename) as ofile:
+    ofile.writerow(headers)
+    
     # Now let's remove lines where the "disadv" value changes
     # but the student ID doesn't.
     # We'll remove *all* lines containing that ID.
-    i = 1
+    # Collect the rows for one student at a time; when the ID
+    # changes, write them all out only if "disadv" never changed.
+    if sort:
+      ifile = sorted_rows(ifile, [groupcol], memory)
     removecount = 0
-    while i < len(data[groupfield]):                   # iterate down columns
-      previousID = data[groupfield][i-1]
-      currentID  = data[groupfield][i]
-      
-      next = i + 1
-      
-      if currentID != previousID:                      # check for change of student
-        start = data[groupfield].index(previousID)     # if so, find first occurrence of previous ID
-        end   = i                                      # (this is one *after* last occurrence)
-        
-        for j in range(start,end):                     # go through all lines with previous ID
-          if data[seqfield][j] != data[seqfield][end-1]: # and look for a change in "disadv" value
-            for k in list(range(end-1, start-1, -1)):  # if so, go backwards
-              for field in data.keys():                # removing all rows with that student ID
-                data[field].pop(k)
-              removecount += 1
-            
-            next = start + 1
-            break                                      # if change found, no more j iteratation
-        
-      i = next
+    group       = []
+    for row in ifile:
+      row = row[:width]
+      if group and row[groupcol] != group[-1][groupcol]:   # check for change of student
+        last = group[-1][seqcol]
+        if any(line[seqcol] != last for line in group):    # look for a change in "disadv" value
+          removecount += len(group)
+        else:
+          ofile.writerows(group)
+        group = []
+      group.append(row)
+    ofile.writerows(group)
   
   print("Total lines removed: {0}".format(str(removecount)))
+
+class RowWriter:
+  """Write rows to a CSV file in large batches, replacing the file only when done.
+
+  Rows are collected in a list and handed over "batch" at a
+  time to csv.writer.writerows, on top of a large file buffer,
+  so writing millions of rows costs little more than the I/O.
+
+  Everything goes to a temporary file next to outfilename,
+  which is renamed to outfilename by close() (or at the end of
+  a "with" block), so readers never see half an output file,
+  and an error part way leaves any earlier output in place.
+  A name ending in '.gz', '.bz2', '.xz' or '.zst' gives a
+  compressed file (see open_file).
+
+  floatformat is a format spec for float values, e.g. '.6f';
+  by default they are written with str(), as csv.writer would.
+  With plain = True fields are simply joined with commas, with
+  no quoting at all, one row per line; otherwise keyword
+  arguments are passed on to csv.writer.
+  """
   
-  # Output to file
-  # write the headers
-  ofile.writerow(headers)
+  def __init__(self, outfilename, floatformat=None, plain=False, batch=1 << 16, **kwargs):
+    basename, ext    = _split_ext(outfilename)
+    self.outfilename = outfilename
+    self.tmpfilename = "{0}.tmp{1}".format(basename, ext)
+    self.floatformat = floatformat
+    self.plain       = plain
+    self.batch       = batch
+    self.rows        = []
+    self.ofile       = open_file(self.tmpfilename, 'w', buffering=1 << 20,
+                                 **({} if plain else {'newline': ''}))
+    self.writer      = None if plain else csv.writer(self.ofile, **kwargs)
+  
+  def _format(self, row):
+    floatformat = self.floatformat
+    return [format(value, floatformat) if isinstance(value, float) else str(value)
+            for value in row]
+  
+  def writerow(self, row):
+    self.rows.append(row)
+    if len(self.rows) >= self.batch:
+      self.flush()
+  
+  def writerows(self, rows):
+    self.rows.extend(rows)
+    if len(self.rows) >= self.batch:
+      self.flush()
+  
+  def flush(self):
+    """Write out the rows collected so far."""
+    
+    rows = self.rows
+    if self.floatformat is not None:
+      rows = map(self._format, rows)
+    elif self.plain:
+      rows = (map(str, row) for row in rows)
+    if self.plain:
+      self.ofile.write(''.join([','.join(row) + '\n' for row in rows]))
+    else:
+      self.writer.writerows(rows)
+    self.rows = []
   
-  # write data row by row
-  for i in range(len(data[groupfield])):
-    lineout = [data[title][i] for title in headers]
-    ofile.writerow(lineout)
+  def close(self):
+    """Write out the last rows and put the file in place."""
+    
+    if self.ofile.closed:
+      return
+    self.flush()
+    self.ofile.close()
+    os.replace(self.tmpfilename, self.outfilename)
+  
+  def discard(self):
+    """Throw away everything written, leaving any earlier output file as it was."""
+    
+    if not self.ofile.closed:
+      self.ofile.close()
+    if os.path.exists(self.tmpfilename):
+      os.remove(self.tmpfilename)
+  
+  def __enter__(self):
+    return self
+  
+  def __exit__(self, kind, value, traceback):
+    if kind is None:
+      self.close()
+    else:
+      self.discard()
+
+import locale, hashlib
 
+def _quote_parity(block, begin, end, parity):
+  """Flip parity once for every double quote in block[begin:end]."""
+  return (parity + block.count(b'"', begin, end)) % 2
+
+def _skip_header(ifile):
+  """Read past the header row of a binary file, returning the offset of the first data row.
+
+  The header row may itself hold quoted newlines.
+  """
+  
+  start  = 0
+  parity = 0
+  for line in ifile:
+    start += len(line)
+    parity = _quote_parity(line, 0, len(line), parity)
+    if parity == 0:
+      break
+  return start
+
+def split_csv(infilename, nchunks, headfilename=None, blocksize=1 << 20):
+  """Cut a CSV file into byte ranges that each hold whole rows.
+
+  Returns a list of (begin, end) byte offsets, at most nchunks
+  long, covering every data row in the file exactly once, so
+  that each range can be read on its own (see read_csv_range),
+  e.g. by a separate process.
+
+  If there's no separate header file, the header is taken to be
+  the first row of the file, and the first range starts after it.
+
+  Each range ends just after a newline, but never one inside a
+  quoted field: a newline is only the end of a row if it comes
+  after an even number of double quotes (doubled "" quotes count
+  twice, so they don't upset the count).  Counting quotes is done
+  on raw blocks of bytes, so this is far quicker than parsing the
+  file, though it does still read it all once.
+  """
+  
+  _require_uncompressed(infilename)
+  size  = os.path.getsize(infilename)
+  ifile = open(infilename, 'rb')
+  start = 0 if headfilename else _skip_header(ifile)
+  
+  # evenly spaced targets; each is moved forward to the next row end
+  nchunks = max(1, min(nchunks, size - start))
+  targets = [start + (size - start) * k // nchunks for k in range(1, nchunks)]
+  bounds  = [start]
+  
+  ifile.seek(start)
+  offset = start                     # file position of block[0]
+  parity = 0
+  while targets:
+    block = ifile.read(blocksize)
+    if not block:
+      break
+    pos = 0                          # parity is counted up to block[pos]
+    while targets:
+      target = max(targets[0] - offset, pos)
+      if target >= len(block):
+        break
+      # the quotes before the target count, whatever the row ends up being
+      parity = _quote_parity(block, pos, target, parity)
+      pos    = target
+      newline = block.find(b'\n', pos)
+      while newline != -1:
+        parity = _quote_parity(block, pos, newline, parity)
+        pos    = newline + 1
+        if parity == 0:
+          break
+        newline = block.find(b'\n', pos)
+      if newline == -1:              # row carries on into the next block
+        targets[0] = offset + len(block)
+        break
+      # found a row end at or past this target
+      bound = offset + pos
+      while targets and targets[0] <= bound:
+        targets.pop(0)
+      if bound < size and bound > bounds[-1]:
+        bounds.append(bound)
+    parity = _quote_parity(block, pos, len(block), parity)
+    offset += len(block)
+  
+  ifile.close()
+  
+  bounds.append(size)
+  return [(bounds[i], bounds[i+1]) for i in range(len(bounds)-1)]
+
+def _rows_with_offsets(ifile, begin, end, encoding):
+  """Iterate over the CSV rows of a binary file between two byte offsets.
+
+  Yields tuples (row, rowbegin, rowend), giving the byte offsets
+  at which each row starts and ends.  csv.reader only asks for
+  another line when the row it's on isn't finished, so the number
+  of bytes handed to it so far is always the end of the last row.
+  """
+  
+  position = begin
+  
+  def lines():
+    nonlocal position
+    ifile.seek(begin)
+    while position < end:
+      line = ifile.readline()
+      if not line:
+        break
+      position += len(line)
+      yield line.decode(encoding)
+  
+  rowbegin = begin
+  for row in csv.reader(lines()):
+    yield row, rowbegin, position
+    rowbegin = position
+
+def read_csv_range(infilename, begin, end, encoding=None):
+  """Iterate over the CSV rows lying between two byte offsets.
+
+  begin and end should be row boundaries, as returned by split_csv
+  or build_column_index.  Rows are returned as lists of strings,
+  just like csv.reader, and the file is decoded with the same
+  default encoding that get_headers uses.
+  """
+  
+  if encoding is None:
+    encoding = locale.getpreferredencoding(False)
+  
+  _require_uncompressed(infilename)
+  with open(infilename, 'rb') as ifile:
+    for row, rowbegin, rowend in _rows_with_offsets(ifile, begin, end, encoding):
+      yield row
+
+def data_start(infilename, headfilename=None):
+  """Return the byte offset of the first data row of a CSV file.
+
+  That's 0 if the column titles are in a separate header file,
+  and just past the first row otherwise.
+  """
+  
+  _require_uncompressed(infilename)
+  if headfilename:
+    return 0
+  with open(infilename, 'rb') as ifile:
+    return _skip_header(ifile)
+
+def sample_digest(infilename, end, sample=1 << 16, blocks=256):
+  """Return a digest of "blocks" blocks of "sample" bytes spread evenly over a file before offset end.
+
+  This is a cheap check that the part of a file read earlier is
+  still there, unchanged, after more has been appended to it.
+  The first and last blocks are always among those read, and if
+  there's no more than blocks * sample bytes (16 MB by default)
+  before end, all of it is hashed.  Beyond that, a change that
+  falls wholly between the blocks, and keeps the length the same,
+  goes unnoticed; a change of length moves every row after it,
+  and so shows up in the later blocks.
+  """
+  
+  digest = hashlib.sha1()
+  with open(infilename, 'rb') as ifile:
+    if end <= sample * blocks:
+      left = end
+      while left > 0:
+        block = ifile.read(min(sample, left))
+        if not block:
+          break
+        digest.update(block)
+        left -= len(block)
+    else:
+      step = (end - sample) / (blocks - 1)
+      for i in range(blocks):
+        ifile.seek(round(i * step))
+        digest.update(ifile.read(sample))
+  return digest.hexdigest()
+
+def build_column_index(infilename, column, headfilename=None, encoding=None):
+  """Record where the rows for each value of a column lie in a CSV file, and save it.
+
+  Returns a dict value:[[begin, end], ...] giving, for each
+  value of the column (e.g. each campus ID), in the order the
+  values first appear, the byte ranges of its rows.  Runs of
+  consecutive rows with the same value share one range, so a
+  file sorted by the column has one range per value.
+
+  The index is kept in the same sidecar file as the line index
+  (see build_line_index) and is thrown away with it if the data
+  file changes.  The values are stored exactly as they appear in
+  the file, without stripping whitespace.
+  """
+  
+  if encoding is None:
+    encoding = locale.getpreferredencoding(False)
+  
+  _require_uncompressed(infilename)
+  headers, hfile = get_headers(infilename, headfilename)
+  col = HeaderSchema(headers).index(column)
+  
+  ranges = {}
+  last   = None
+  with open(infilename, 'rb') as ifile:
+    start = 0 if headfilename else _skip_header(ifile)
+    size  = os.fstat(ifile.fileno()).st_size
+    for row, begin, end in _rows_with_offsets(ifile, start, size, encoding):
+      if len(row) <= col:               # e.g. a blank line
+        last = None
+        continue
+      value = row[col]
+      if value == last:
+        ranges[value][-1][1] = end      # same run of rows, just longer
+      else:
+        ranges.setdefault(value, []).append([begin, end])
+        last = value
+  
+  sidecar = _load_sidecar(infilename)
+  sidecar.setdefault('columns', {})[column] = ranges
+  _save_sidecar(infilename, sidecar)
+  return ranges
+
+def load_column_index(infilename, column):
+  """Return the saved index of a column, or None if there isn't a current one."""
+  
+  return _load_sidecar(infilename).get('columns', {}).get(column)
+
+def get_column_index(infilename, column, headfilename=None):
+  """Return the saved index of a column, building it first if need be.
+
+  The keys of the index are the distinct values of the column,
+  e.g. every campus ID in the file, in the order they first appear.
+  """
+  
+  ranges = load_column_index(infilename, column)
+  if ranges is None:
+    ranges = build_column_index(infilename, column, headfilename)
+  return ranges
+
+def read_rows_where(infilename, column, value, headfilename=None):
+  """Iterate over just the rows of a CSV file whose column has a given value.
+
+  Uses the column index (building it if need be) to read only
+  the byte ranges holding those rows.
+  """
+  
+  for begin, end in get_column_index(infilename, column, headfilename).get(value, []):
+    for row in read_csv_range(infilename, begin, end):
+      yield row
+
+import array, mmap
+
+class ColumnCache:
+  """A typed copy of some columns of a CSV file, one file per column.
+
+  Numeric columns are arrays of doubles, with blanks stored
+  as NaN.  String columns are dictionary encoded: an array of
+  integer codes, plus the list of distinct values in the order
+  they first appear, so code k stands for values(title)[k].
+  The column files are memory mapped, so opening the cache
+  reads nothing until a column is used, and only the columns
+  asked for are ever touched.  A rebuilt cache replaces the
+  files rather than rewriting them, so a ColumnCache opened
+  before keeps reading the old ones.
+
+  Get one with get_column_cache rather than building it directly,
+  and close() it (or use it in a "with" block) when done.
+  """
+
+  def __init__(self, dirname, meta):
+    self.dirname = dirname
+    self.meta    = meta
+    self.maps    = {}
+
+  def __len__(self):
+    return self.meta['rows']
+
+  def __contains__(self, title):
+    return title in self.meta['columns']
+
+  def _view(self, title, kind, typecode):
+    column = self.meta['columns'][title]
+    if column['type'] != kind:
+      raise ValueError("{0} is not cached as a {1} column".format(title, kind))
+    if self.meta['rows'] == 0:
+      return memoryview(array.array(typecode))
+    if title not in self.maps:
+      with open(os.path.join(self.dirname, column['file']), 'rb') as cfile:
+        self.maps[title] = mmap.mmap(cfile.fileno(), 0, access=mmap.ACCESS_READ)
+    return memoryview(self.maps[title]).cast(typecode)
+
+  def numeric(self, title):
+    """Return a numeric column, as a read-only memoryview of doubles."""
+    return self._view(title, 'float', 'd')
+
+  def codes(self, title):
+    """Return the codes of a string column, as a read-only memoryview of ints."""
+    return self._view(title, 'str', 'i')
+
+  def values(self, title):
+    """Return the distinct values of a string column, indexed by code."""
+    return self.meta['columns'][title]['values']
+
+  def strings(self, title):
+    """Iterate over a string column, one value per row."""
+    values = self.values(title)
+    for code in self.codes(title):
+      yield values[code]
+
+  def close(self):
+    """Release the memory maps.
+
+    A map that a column's memoryview still points into can't be
+    closed yet; it is released when the last such view goes.
+    """
+    for cmap in self.maps.values():
+      try:
+        cmap.close()
+      except BufferError:
+        pass
+    self.maps = {}
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, kind, value, traceback):
+    self.close()
+
+
+def _cache_dirname(infilename):
+  """Return the name of the directory holding the column cache for a data file."""
+  
+  return infilename + '.cols'
+
+def _build_column_cache(infilename, headfilename, meta, numeric, strings):
+  """Parse the CSV file once, adding the given columns to the cache.
+
+  Each file is written under a temporary name and then renamed
+  into place, so one that is memory mapped (by another process,
+  or an earlier ColumnCache) is never changed underneath it.
+  """
+  
+  dirname = _cache_dirname(infilename)
+  tmpext  = ".{0}.tmp".format(os.getpid())
+  os.makedirs(dirname, exist_ok=True)
+  
+  headers, ifile = get_headers(infilename, headfilename)
+  positions = HeaderSchema(headers).require(*(list(numeric) + list(strings)))
+  
+  # one output file, buffer and (for strings) dictionary per column
+  nan     = float('nan')
+  columns = []
+  for title, position in zip(list(numeric) + list(strings), positions):
+    kind     = 'float' if title in numeric else 'str'
+    filename = "{0}.{1}".format(position, 'f8' if kind == 'float' else 'i4')
+    columns.append({
+      'title': title,
+      'position': position,
+      'kind': kind,
+      'file': filename,
+      'ofile': open(os.path.join(dirname, filename + tmpext), 'wb'),
+      'buffer': array.array('d' if kind == 'float' else 'i'),
+      'codes': {}
+    })
+  
+  rows = 0
+  try:
+    for row in ifile:
+      for column in columns:
+        value = row[column['position']]
+        if column['kind'] == 'float':
+          value = value.strip()
+          column['buffer'].append(float(value) if value != '' else nan)
+        else:
+          codes = column['codes']
+          code  = codes.get(value)
+          if code is None:
+            code = codes[value] = len(codes)
+          column['buffer'].append(code)
+      rows += 1
+      if rows % 65536 == 0:
+        for column in columns:
+          column['buffer'].tofile(column['ofile'])
+          del column['buffer'][:]
+    for column in columns:
+      column['buffer'].tofile(column['ofile'])
+      column['ofile'].close()
+  except BaseException:
+    for column in columns:
+      column['ofile'].close()
+      os.remove(column['ofile'].name)
+    raise
+  
+  for column in columns:
+    os.replace(column['ofile'].name, os.path.join(dirname, column['file']))
+    meta['columns'][column['title']] = {
+      'type': column['kind'],
+      'file': column['file'],
+      'values': list(column['codes']) if column['kind'] == 'str' else None
+    }
+  meta['rows'] = rows
+  
+  # the description goes last, so a half-built cache is never used
+  mfilename = os.path.join(dirname, 'meta.json')
+  with open(mfilename + tmpext, 'w') as mfile:
+    json.dump(meta, mfile)
+  os.replace(mfilename + tmpext, mfilename)
+
+def get_column_cache(infilename, headfilename=None, numeric=(), strings=()):
+  """Return a ColumnCache for a CSV file, building or extending it if need be.
+
+  "numeric" and "strings" name the columns wanted as numbers
+  (e.g. scores and pay) and as dictionary-encoded strings (e.g.
+  campus, year, district category).  Columns already in the
+  cache are reused; any others are added with a single pass
+  over the CSV file.
+
+  The cache lives in a directory next to the data file (its
+  name plus '.cols') and records the file's full path, size
+  and modification time; if any of those change, the whole
+  cache is rebuilt rather than serving stale data.
+  """
+  
+  dirname = _cache_dirname(infilename)
+  stat    = os.stat(infilename)
+  fresh   = {
+    'source': os.path.abspath(infilename),
+    'size': stat.st_size,
+    'mtime': stat.st_mtime,
+    'rows': 0,
+    'columns': {}
+  }
+  try:
+    with open(os.path.join(dirname, 'meta.json'), 'r') as mfile:
+      meta = json.load(mfile)
+  except (OSError, ValueError):
+    meta = fresh
+  if any(meta.get(key) != fresh[key] for key in ('source', 'size', 'mtime')):
+    meta = fresh
+  
+  def cached(title, kind):
+    return meta['columns'].get(title, {}).get('type') == kind
+  
+  missingNumeric = [title for title in numeric if not cached(title, 'float')]
+  missingStrings = [title for title in strings if not cached(title, 'str')]
+  if missingNumeric or missingStrings or meta is fresh:
+    _build_column_cache(infilename, headfilename, meta, missingNumeric, missingStrings)
+  
+  return ColumnCache(dirname, meta)
+
+import heapq, tempfile, shutil, operator
+
+# how much memory sorting may use for rows, by default (bytes)
+SORT_MEMORY = 256 << 20
+
+def _row_size(row):
+  """Roughly how many bytes of memory a csv.reader row takes up."""
+  return 120 + sum(map(len, row)) + 56 * len(row)
+
+def _spill(rows, dirname):
+  """Write sorted rows to a new file in dirname, closed again, and return its name."""
+  
+  fd, runname = tempfile.mkstemp(suffix='.csv', dir=dirname)
+  with open(fd, 'w', newline='') as run:
+    csv.writer(run).writerows(rows)
+  return runname
+
+def _open_runs(runnames):
+  """Open run files for reading, closing any already opened if one fails."""
+  
+  runs = []
+  try:
+    for runname in runnames:
+      runs.append(open(runname, 'r', newline=''))
+  except BaseException:
+    for run in runs:
+      run.close()
+    raise
+  return runs
+
+def _merge_runs(runnames, key, dirname, fanin):
+  """Merge sorted runs, "fanin" at a time, until there are few enough to merge at once.
+
+  Only the runs being merged are open, so no more than fanin + 1
+  files are open at any time, however many runs there are.
+  Runs are always merged in the order they were made, and
+  heapq.merge takes equal rows from earlier runs first, so
+  rows with equal keys stay in the order they were read.
+  """
+  
+  while len(runnames) > fanin:
+    merged = []
+    for i in range(0, len(runnames), fanin):
+      group = runnames[i:i+fanin]
+      runs  = _open_runs(group)
+      try:
+        merged.append(_spill(heapq.merge(*map(csv.reader, runs), key=key), dirname))
+      finally:
+        for run in runs:
+          run.close()
+      for runname in group:
+        os.remove(runname)
+    runnames = merged
+  return runnames
+
+def sorted_rows(rows, keycols, memory=None, tmpdir=None, fanin=64):
+  """Iterate over rows sorted by the fields at positions keycols, using limited memory.
+
+  Rows are collected until they take up about "memory" bytes
+  (SORT_MEMORY by default), sorted, and spilled to a file in
+  a temporary directory in tmpdir (the system's by default) as
+  a sorted run; the runs are then merged, up to "fanin" at once,
+  as the sorted rows are read.  A run's file is only open while
+  it's being written or merged, so fanin also limits how many
+  files are open.  If all the rows fit in memory, no temporary
+  files are used at all.
+
+  Keys are compared as strings.  The sort is stable: rows with
+  the same key come out in the order they went in.
+  """
+  
+  if memory is None:
+    memory = SORT_MEMORY
+  key = operator.itemgetter(*keycols)
+  
+  dirname  = None
+  runnames = []
+  runs     = []
+  batch    = []
+  size     = 0
+  try:
+    for row in rows:
+      batch.append(row)
+      size += _row_size(row)
+      if size >= memory:
+        batch.sort(key=key)
+        if dirname is None:
+          dirname = tempfile.mkdtemp(prefix='sort', dir=tmpdir)
+        runnames.append(_spill(batch, dirname))
+        batch = []
+        size  = 0
+    batch.sort(key=key)
+    if not runnames:
+      yield from batch
+      return
+    if batch:
+      runnames.append(_spill(batch, dirname))
+      batch = []
+    runnames = _merge_runs(runnames, key, dirname, fanin)
+    runs     = _open_runs(runnames)
+    yield from heapq.merge(*map(csv.reader, runs), key=key)
+  finally:
+    for run in runs:
+      run.close()
+    if dirname is not None:
+      shutil.rmtree(dirname, ignore_errors=True)
+
+def sort_csv(infilename, outfilename, keys, headfilename=None, memory=None, tmpdir=None, threaded=False):
+  """Sort a CSV file by one or more columns, without holding it all in memory.
+
+  "keys" is a list of column titles to sort by, in order of
+  precedence; memory and tmpdir are as for sorted_rows.  The
+  output is written with a RowWriter, so it may be compressed,
+  and keeps the header row if the input had one (with a
+  separate header file, the same one still goes with it).
+  """
+  
+  headers, ifile = get_headers(infilename, headfilename, threaded)
+  keycols        = HeaderSchema(headers).require(*keys)
+  
+  with RowWriter(outfilename) as ofile:
+    if not headfilename:
+      ofile.writerow(headers)
+    for row in sorted_rows(ifile, keycols, memory, tmpdir):
+      ofile.writerow(row)
+
+def group_rows(infilename, keys, headfilename=None, memory=None, tmpdir=None, threaded=False):
+  """Iterate over the rows of a CSV file grouped by one or more columns, in any order.
+
+  Yields (key, rows) for each distinct value of the key columns,
+  in sorted order, where key is a tuple of the key fields and
+  rows is a list of the rows with that key, in file order.  The
+  file is sorted as it is read, as by sort_csv, so rows with
+  the same key needn't be next to each other.
+  """
+  
+  headers, ifile = get_headers(infilename, headfilename, threaded)
+  keycols        = HeaderSchema(headers).require(*keys)
+  key            = lambda row: tuple(row[col] for col in keycols)
+  
+  for value, rows in itertools.groupby(sorted_rows(ifile, keycols, memory, tmpdir), key):
+    yield value, list(rows)
+
+import time, contextlib, cProfile, pstats, tracemalloc
+try:
+  import resource
+except ImportError:
+  resource = None
+
+def _rusage():
+  """Return (CPU seconds, peak RSS in kB) for this process, then the same for its finished children."""
+  
+  if resource is None:
+    return time.process_time(), None, 0.0, None
+  scale = 1024 if sys.platform == 'darwin' else 1     # ru_maxrss is in bytes on macOS
+  me    = resource.getrusage(resource.RUSAGE_SELF)
+  kids  = resource.getrusage(resource.RUSAGE_CHILDREN)
+  return (me.ru_utime + me.ru_stime, me.ru_maxrss // scale,
+          kids.ru_utime + kids.ru_stime, kids.ru_maxrss // scale)
+
+class StageReport:
+  """Wall time, CPU time, rows, bytes read and peak memory for each stage of a run.
+
+  Wrap each stage in "with report.stage(name) as record:", or
+  put it between "record = report.start(name)" and
+  "report.finish(record)", and set record['rows'] (and
+  record['bytes'], if known) along the way; the rest is measured
+  at the start and finish, so nothing at all is done per row.
+  CPU time includes child processes (e.g. a multiprocessing.Pool)
+  that finished during the stage, and the peak memory is the
+  resident set size of this process and of its largest child
+  so far.
+
+  With profile = True, each stage is also run under cProfile,
+  and tracemalloc follows its Python memory use; the "top"
+  functions by cumulative time, and the peak traced memory,
+  go in the stage's record.  That slows things down a good deal,
+  but only in this process: child processes aren't profiled.
+  If the report started tracemalloc, close() (which save() calls)
+  stops it again, so a long-lived process doesn't go on paying
+  for it after the report is done.
+
+  A disabled report (enabled = False) measures nothing, and its
+  stages cost a function call or two each.
+  """
+  
+  def __init__(self, enabled=True, profile=False, top=20):
+    self.enabled = enabled or profile
+    self.profile = profile
+    self.top     = top
+    self.stages  = []
+    self.began   = time.perf_counter()
+    self.tracing = profile and not tracemalloc.is_tracing()
+    if self.tracing:
+      tracemalloc.start()
+  
+  def start(self, name):
+    """Start timing a stage, returning its record; pass that to finish() at the end of it."""
+    
+    record = {'name': name, 'rows': None, 'bytes': None}
+    if self.enabled:
+      if self.profile:
+        tracemalloc.reset_peak()
+        record['_profiler'] = cProfile.Profile()
+        record['_profiler'].enable()
+      record['_usage'] = _rusage()
+      record['_wall']  = time.perf_counter()
+    return record
+  
+  def finish(self, record):
+    """Finish timing a stage, adding its record to the report."""
+    
+    if not self.enabled:
+      return
+    wall = time.perf_counter() - record.pop('_wall')
+    profiler = record.pop('_profiler', None)
+    if profiler is not None:
+      profiler.disable()
+    cpu, rss, kidsCpu, kidsRss = record.pop('_usage')
+    endCpu, endRss, endKidsCpu, endKidsRss = _rusage()
+    record['wall_seconds']  = wall
+    record['cpu_seconds']   = (endCpu - cpu) + (endKidsCpu - kidsCpu)
+    record['rows_per_sec']  = record['rows'] / wall if record['rows'] and wall > 0 else None
+    record['bytes_per_sec'] = record['bytes'] / wall if record['bytes'] and wall > 0 else None
+    record['peak_rss_kb']   = endRss
+    record['peak_child_rss_kb'] = endKidsRss or None
+    if profiler is not None:
+      record['peak_traced_bytes'] = tracemalloc.get_traced_memory()[1]
+      record['profile'] = self._top_functions(profiler)
+    self.stages.append(record)
+  
+  @contextlib.contextmanager
+  def stage(self, name):
+    """Time the body of a "with" block as a stage (see start and finish)."""
+    
+    record = self.start(name)
+    try:
+      yield record
+    finally:
+      self.finish(record)
+  
+  def _top_functions(self, profiler):
+    stats = pstats.Stats(profiler).stats
+    top   = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:self.top]
+    return [{'function': "{0}:{1}({2})".format(*where),
+             'calls': calls, 'tottime': tottime, 'cumtime': cumtime}
+            for where, (primitive, calls, tottime, cumtime, callers) in top]
+  
+  def as_dict(self):
+    """Return the report, e.g. to save as JSON."""
+    
+    cpu, rss, kidsCpu, kidsRss = _rusage()
+    return {'wall_seconds': time.perf_counter() - self.began,
+            'cpu_seconds': cpu + kidsCpu,
+            'peak_rss_kb': rss,
+            'peak_child_rss_kb': kidsRss or None,
+            'stages': self.stages}
+  
+  def save(self, filename):
+    """Save the report as JSON, closing it first."""
+    
+    self.close()
+    with open(filename, 'w') as rfile:
+      json.dump(self.as_dict(), rfile, indent=1)
+  
+  def close(self):
+    """Stop tracemalloc, if this report started it."""
+    
+    if self.tracing:
+      tracemalloc.stop()
+      self.tracing = False
+  
+  def __enter__(self):
+    return self
+  
+  def __exit__(self, kind, value, traceback):
+    self.close()
+  
+  def summary(self):
+    """Return a few lines of text summing up each stage."""
+    
+    lines = ["{0:<12}{1:>10}{2:>10}{3:>12}{4:>14}{5:>12}".format(
+      'stage', 'wall s', 'CPU s', 'rows', 'rows/sec', 'peak kB')]
+    for record in self.stages:
+      lines.append("{0:<12}{1:>10.2f}{2:>10.2f}{3:>12}{4:>14}{5:>12}".format(
+        record['name'], record['wall_seconds'], record['cpu_seconds'],
+        record['rows'] if record['rows'] is not None else '-',
+        "{0:.0f}".format(record['rows_per_sec']) if record['rows_per_sec'] else '-',
+        record['peak_rss_kb'] if record['peak_rss_kb'] is not None else '-'))
+    return lines
@@ -5,26 +5,50 @@
 
 from math import sqrt
 
+# NumPy is optional: if it's installed, correlations are
+# computed with it, otherwise with plain Python lists
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# a column whose values are all the same (or that has none)
+# has no correlation with anything, with or without NumPy
+_NO_SPREAD = "a column of data with no spread has no correlation"
+
+def _corr_numpy(data):
+    """Find the matrix of correlations between several columns of data.
+
+    The argument "data" is a sequence of k equal-length lists
+    (or arrays).  All k*k sums of products are found at once,
+    after subtracting each column's mean, which avoids the
+    cancellation that n*sum(x**2) - sum(x)**2 suffers when the
+    values are large compared with their spread.
+
+    A column with no spread raises ZeroDivisionError, just as
+    in CorrAccumulator, rather than giving NaN.
+    """
+    
+    x = numpy.array(data, dtype=float, ndmin=2)
+    if (x == x[:, :1]).all(axis=1).any():     # its mean could be off by a rounding error
+        raise ZeroDivisionError(_NO_SPREAD)
+    x -= x.mean(axis=1, keepdims=True)       # centre each column
+    comoments = x @ x.T                        # every sum of products in one pass
+    scale = numpy.sqrt(numpy.diag(comoments))
+    return comoments / numpy.outer(scale, scale)
+
 def corr(x, y):
-    """Find the correlation between two lists of data."""
+    """Find the correlation between two lists of data.
+
+    Either argument may also be a NumPy array; if NumPy is
+    installed it is used for the arithmetic, and otherwise a
+    CorrAccumulator.  Either way the data is centred on its
+    mean, and a list with no spread raises ZeroDivisionError.
+    """
     
     assert len(x) == len(y), "lists must have equal length"
     
-    xSum = sum(x)
-    ySum = sum(y)
-    
-    xSumSq = sum([item**2 for item in x])
-    ySumSq = sum([item**2 for item in y])
-    
-    iProd = 0.0
-    for i in range(len(x)):
-      iProd += x[i]*y[i]
-    
-    n = len(x)
-    
-    r = n*iProd - xSum*ySum
-    r /= sqrt(n*xSumSq - xSum**2) * sqrt(n*ySumSq - ySum**2)
-    return r
+    return float(corr_matrix([x, y])[0][1])
 
 def corr3(data):
     """Find the correlation between three lists of data.
@@ -45,9 +69,13 @@ def corr3(data):
     y = data[1]
     z = data[2] if len(data) > 2 else None
     
-    rxy = corr(x,y)
-    rxz = corr(x,z) if z != None else 0
-    ryz = corr(y,z) if z != None else 0
+    # all three correlations from one pass over the data
+    assert len(x) == len(y), "lists must have equal length"
+    assert z is None or len(x) == len(z), "lists must have equal length"
+    r = corr_matrix([x, y] if z is None else [x, y, z])
+    rxy = float(r[0][1])
+    rxz = float(r[0][2]) if z is not None else 0
+    ryz = float(r[1][2]) if z is not None else 0
     
     # if no z-column, this gives rxy
     rxy_z = rxy - rxz * ryz
@@ -71,3 +99,179 @@ def corr3(data):
     return (rxy_z, rxz_y, ryz_x)
 
 
+def _invert(matrix):
+    """Invert a square matrix (a list of lists) by Gauss-Jordan elimination."""
+    
+    k = len(matrix)
+    a = [list(row) + [1.0 if i == j else 0.0 for j in range(k)]
+         for i, row in enumerate(matrix)]
+    for col in range(k):
+        pivot = max(range(col, k), key=lambda i: abs(a[i][col]))
+        if abs(a[pivot][col]) < 1e-12:
+            raise ValueError("matrix is singular")
+        a[col], a[pivot] = a[pivot], a[col]
+        p = a[col][col]
+        a[col] = [value / p for value in a[col]]
+        for i in range(k):
+            if i != col and a[i][col] != 0.0:
+                f = a[i][col]
+                a[i] = [value - f * pivotValue for value, pivotValue in zip(a[i], a[col])]
+    return [row[k:] for row in a]
+
+def _partial_from_corr(r):
+    """Turn a correlation matrix (a list of lists) into a partial correlation matrix."""
+    
+    if numpy is not None:
+        a = numpy.array(r)
+        if numpy.linalg.matrix_rank(a) < len(a):
+            raise ValueError("matrix is singular")
+        p = numpy.linalg.inv(a).tolist()
+    else:
+        p = _invert(r)
+    
+    k = len(r)
+    return [[1.0 if i == j else -p[i][j] / sqrt(p[i][i] * p[j][j])
+             for j in range(k)] for i in range(k)]
+
+
+class CorrAccumulator:
+    """Running statistics for correlating several variables.
+
+    Values are added one row at a time, e.g.
+        acc = CorrAccumulator(3)
+        for salary, experience, score in rows:
+            acc.add(salary, experience, score)
+    or a batch of rows at a time with add_rows, so the data
+    never has to be held in lists.  The accumulator keeps only
+    the count n, the mean of each variable and the centred
+    sums of products ("co-moments"), updated with Welford's
+    method, so it is as accurate as centring the data first.
+
+    Two accumulators for different parts of the same data,
+    e.g. from separate processes, can be combined with merge,
+    giving the same statistics as one accumulator fed all rows.
+    """
+    
+    def __init__(self, k):
+        self.k = k
+        self.n = 0
+        self.means = [0.0] * k
+        self.comoments = [[0.0] * k for i in range(k)]
+    
+    def add(self, *values):
+        """Add one value of each variable."""
+        
+        assert len(values) == self.k, "need one value per variable"
+        
+        self.n += 1
+        d = [value - mean for value, mean in zip(values, self.means)]
+        self.means = [mean + di / self.n for mean, di in zip(self.means, d)]
+        f = (self.n - 1) / self.n
+        for i in range(self.k):
+            di = d[i] * f
+            ci = self.comoments[i]
+            for j in range(self.k):
+                ci[j] += di * d[j]
+    
+    def add_rows(self, rows):
+        """Add a batch of rows, each holding one value of each variable."""
+        
+        if numpy is None:
+            for row in rows:
+                self.add(*row)
+            return
+        
+        x = numpy.array(list(rows), dtype=float).reshape(-1, self.k)
+        if len(x) == 0:
+            return
+        batch = CorrAccumulator(self.k)
+        batch.n = len(x)
+        # a column of equal values has exactly that mean, as add would give
+        batch.means = numpy.where((x == x[0]).all(axis=0), x[0], x.mean(axis=0)).tolist()
+        x -= batch.means
+        batch.comoments = (x.T @ x).tolist()
+        self.merge(batch)
+    
+    def merge(self, other):
+        """Add in all the rows that went into another accumulator."""
+        
+        assert other.k == self.k, "accumulators must have the same number of variables"
+        
+        if other.n == 0:
+            return
+        n = self.n + other.n
+        d = [b - a for a, b in zip(self.means, other.means)]
+        f = self.n * other.n / n
+        self.means = [a + di * other.n / n for a, di in zip(self.means, d)]
+        for i in range(self.k):
+            ci = self.comoments[i]
+            oi = other.comoments[i]
+            for j in range(self.k):
+                ci[j] += oi[j] + d[i] * d[j] * f
+        self.n = n
+    
+    def covariance(self):
+        """Return the (sample) covariance matrix as a list of lists."""
+        
+        return [[cij / (self.n - 1) for cij in row] for row in self.comoments]
+    
+    def corr_matrix(self):
+        """Return the correlation between every pair of variables."""
+        
+        scale = [sqrt(self.comoments[i][i]) for i in range(self.k)]
+        if 0.0 in scale:
+            raise ZeroDivisionError(_NO_SPREAD)
+        return [[cij / (scale[i] * scale[j]) for j, cij in enumerate(row)]
+                for i, row in enumerate(self.comoments)]
+    
+    def partial_corr_matrix(self):
+        """Return the partial correlation between every pair of variables.
+
+        See partial_corr_matrix.
+        """
+        
+        return _partial_from_corr(self.corr_matrix())
+    
+    def corr(self, i=0, j=1):
+        """Return the correlation between variables i and j."""
+        
+        return self.corr_matrix()[i][j]
+
+
+def corr_matrix(columns):
+    """Find the correlation between every pair of several lists of data.
+
+    The argument "columns" is a list of k equal-length lists
+    (or arrays), e.g. [salary, experience, score, category].
+    The output is a k*k list of lists, whose [i][j] entry is
+    the correlation between columns i and j.
+
+    Every correlation comes from the same centred sums of
+    products, found in a single pass over the data.
+    """
+    
+    if numpy is not None:
+        return _corr_numpy(columns).tolist()
+    
+    n = len(columns[0])
+    for column in columns:
+        assert len(column) == n, "lists must have equal length"
+    
+    acc = CorrAccumulator(len(columns))
+    acc.add_rows(zip(*columns))
+    return acc.corr_matrix()
+
+def partial_corr_matrix(columns):
+    """Find the partial correlation between every pair of several lists of data.
+
+    Like corr_matrix, but the [i][j] entry is the correlation
+    between columns i and j holding all the other columns fixed.
+    With three columns this gives the same numbers as corr3.
+
+    The partial correlations are read off the inverse P of the
+    correlation matrix:  -P[i][j] / sqrt(P[i][i] * P[j][j]).
+    A ValueError is raised if the correlation matrix is singular,
+    e.g. if one column is a combination of the others.
+    """
+    
+    return _partial_from_corr(corr_matrix(columns))
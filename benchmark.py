@@ -0,0 +1,391 @@
+#!/usr/bin/env python3.1
+
+# benchmark.py
+# A script to time FileManip, StatsFns and salary.py
+# on synthetic TAKS and TEA data of whatever size we like
+
+import sys, os, csv, json, time, random, platform, subprocess
+import FileManip as fm
+import StatsFns as sf
+
+
+SUBJECTS  = ['MATHEMATICS', 'Math Lab', 'ALGEBRA I', 'ENGLISH', 'SCIENCE',
+             'HISTORY', 'ART', 'SPANISH', 'MUSIC', 'PHYSICAL EDUCATION', '']
+DISTRICTS = ['Major urban', 'Major suburban', 'Other central city',
+             'Independent town', 'Rural', 'Suburban, large', 'Suburban, small']
+# fields that give a CSV parser trouble: commas, quotes and newlines
+AWKWARD   = ['a, b', 'say "hi"', 'line\nbreak', '"quoted"', "it's", ' spaced ']
+
+def generate(workdir, rows, campuses, subjects, years, teachers, teacherFiles, awkward, seed):
+    """Write a synthetic TAKS file and TEA files to workdir.
+
+    TAKS.csv has "rows" rows for students at "campuses" schools,
+    with one to four rows in a row for each student, spread over
+    "years"; a fraction "awkward" of its free-text fields are
+    quoted or hold commas or newlines.  TCHM01.csv, TCHM02.csv,
+    ... each have "teachers" teachers with "subjects" subject
+    columns.  The same seed always gives the same files.
+    """
+
+    rand = random.Random(seed)
+    os.makedirs(workdir, exist_ok=True)
+    campusIDs = ["{0:06d}".format(rand.randint(1, 999999)) for i in range(campuses)]
+
+    def note():
+        return rand.choice(AWKWARD) if rand.random() < awkward else 'x'
+
+    with open(os.path.join(workdir, 'TAKS.csv'), 'w', newline='') as dFile:
+        writer = csv.writer(dFile)
+        writer.writerow(['sid', 'campus', 'year', 'm_raw', 'm_ssc', 'r_raw', 'r_ssc', 'note'])
+        sid = 0
+        written = 0
+        while written < rows:
+            campus = rand.choice(campusIDs)
+            for year in rand.sample(years, min(len(years), rand.randint(1, 4))):
+                if written == rows:
+                    break
+                mRaw = '' if rand.random() < 0.05 else str(rand.randint(0, 60))
+                writer.writerow([sid, campus, year, mRaw, rand.randint(1000, 3000),
+                                 rand.randint(0, 50), rand.randint(1000, 3000), note()])
+                written += 1
+            sid += 1
+
+    for k in range(1, teacherFiles + 1):
+        tPath = os.path.join(workdir, "TCHM{0:02d}.csv".format(k))
+        with open(tPath, 'w', newline='') as tFile:
+            writer = csv.writer(tFile)
+            writer.writerow(['TEACHER ID', 'CAMPUS NUMBER', 'BASE PAY', 'EXPERIENCE',
+                             'DISTRICT CATEGORY NAME'] +
+                            ["SUBJECT AREA NAME {0}".format(j) for j in range(1, subjects + 1)])
+            for i in range(teachers):
+                writer.writerow([i, ' ' + rand.choice(campusIDs) + ' ',
+                                 round(rand.uniform(30000, 80000), 2), rand.randint(0, 35),
+                                 rand.choice(DISTRICTS)] +
+                                [rand.choice(SUBJECTS) for j in range(subjects)])
+
+
+def count_rows(dPath):
+    """Return the number of rows (not counting the header) in a CSV file."""
+
+    with open(dPath, newline='') as dFile:
+        return sum(1 for row in csv.reader(dFile)) - 1
+
+# Each benchmark takes the work directory and returns the
+# number of rows it got through.  Each runs in a fresh
+# process of its own, so that its peak memory is its own.
+
+def bench_extract_fields(workdir):
+    count = 0
+    with open(os.path.join(workdir, 'TAKS.csv')) as dFile:
+        for line in dFile:
+            fm.extract_fields(line)
+            count += 1
+    return count
+
+def bench_extract_fields_by_char(workdir):
+    count = 0
+    with open(os.path.join(workdir, 'TAKS.csv')) as dFile:
+        for line in dFile:
+            fm._extract_fields_by_char(line)
+            count += 1
+    return count
+
+# TEA lines have more (and more often quoted) fields than TAKS lines
+def bench_extract_fields_tea(workdir):
+    count = 0
+    with open(os.path.join(workdir, 'TCHM01.csv')) as tFile:
+        for line in tFile:
+            fm.extract_fields(line)
+            count += 1
+    return count
+
+def bench_extract_fields_tea_by_char(workdir):
+    count = 0
+    with open(os.path.join(workdir, 'TCHM01.csv')) as tFile:
+        for line in tFile:
+            fm._extract_fields_by_char(line)
+            count += 1
+    return count
+
+def bench_get_csv_columns(workdir):
+    headers, data = fm.get_csv_columns(os.path.join(workdir, 'TAKS.csv'))
+    return len(data[headers[0]])
+
+def bench_extract_chunk(workdir):
+    dPath = os.path.join(workdir, 'TAKS.csv')
+    fm.extract_chunk(dPath, os.path.join(workdir, 'out', 'chunk.csv'), 0, 1 << 60, period=1 << 20)
+    return sum(1 for line in open(dPath))
+
+def bench_extract_sequential(workdir):
+    dPath = os.path.join(workdir, 'TAKS.csv')
+    fm.extract_sequential('sid', 'year', dPath, outfilename=os.path.join(workdir, 'out', 'seq.csv'))
+    return count_rows(dPath)
+
+def _score_columns(workdir):
+    headers, data = fm.get_csv_columns(os.path.join(workdir, 'TAKS.csv'),
+                                       columns=['m_ssc', 'r_raw', 'r_ssc'],
+                                       types={'m_ssc': float, 'r_raw': float, 'r_ssc': float})
+    return [data[title] for title in headers]
+
+def bench_corr(workdir):
+    x, y, z = _score_columns(workdir)
+    start = time.perf_counter()
+    sf.corr(x, y)
+    return len(x), time.perf_counter() - start
+
+def bench_corr3(workdir):
+    x, y, z = _score_columns(workdir)
+    start = time.perf_counter()
+    sf.corr3([x, y, z])
+    return len(x), time.perf_counter() - start
+
+# salary.py, end to end, is run as it is, with this many jobs
+SALARY_JOBS = {'salary': 1, 'salary_jobs': os.cpu_count() or 1}
+
+BENCHMARKS = ['extract_fields', 'extract_fields_by_char', 'extract_fields_tea',
+              'extract_fields_tea_by_char', 'get_csv_columns', 'extract_chunk',
+              'extract_sequential', 'corr', 'corr3', 'salary', 'salary_jobs']
+
+def run_one(name, workdir):
+    """Run one benchmark here and now, printing its rows and seconds as JSON."""
+
+    start  = time.perf_counter()
+    result = globals()['bench_' + name](workdir)
+    seconds = time.perf_counter() - start
+    if isinstance(result, tuple):          # timed just the part that counts
+        result, seconds = result
+    print(json.dumps({'rows': result, 'seconds': seconds}))
+
+def measure(name, workdir):
+    """Run one benchmark in a separate process, returning its rows, seconds and peak memory."""
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    if name in SALARY_JOBS:
+        command = [sys.executable, os.path.join(here, 'salary.py'), '-y', '2007',
+                   '-j', str(SALARY_JOBS[name]), '-o', os.path.join(workdir, 'out'),
+                   '-f', workdir + os.sep, 'TCHM*.csv', os.path.join(workdir, 'TAKS.csv')]
+    else:
+        command = [sys.executable, os.path.join(here, 'benchmark.py'), '--run', name, workdir]
+
+    start  = time.perf_counter()
+    child  = subprocess.Popen(command, stdout=subprocess.PIPE)
+    output = child.stdout.read()
+    pid, status, usage = os.wait4(child.pid, 0)
+    seconds = time.perf_counter() - start
+    child.stdout.close()
+    if status != 0:
+        raise RuntimeError("benchmark {0} failed".format(name))
+    if name in SALARY_JOBS:
+        result = {'rows': count_rows(os.path.join(workdir, 'TAKS.csv')), 'seconds': seconds}
+    else:
+        result = json.loads(output.decode().splitlines()[-1])
+    # ru_maxrss is in kilobytes on Linux, bytes on macOS; for
+    # salary.py with jobs, the processes it starts aren't counted
+    peak = usage.ru_maxrss // 1024 if sys.platform == 'darwin' else usage.ru_maxrss
+    result['peak_rss_kb'] = peak
+    return result
+
+
+if __name__ == "__main__":
+
+    # defaults
+    rows = 200000
+    campuses = 1000
+    subjects = 6
+    years = ['2006', '2007', '2008']
+    teachers = 20000
+    teacherFiles = 4
+    awkward = 0.05
+    seed = 1
+    repeat = 3
+    only = None
+    outfilename = None
+    compare = None
+    error = "Use --help option for assistance"
+
+    # a benchmark run on its own, by measure()
+    if len(sys.argv) == 4 and sys.argv[1] == '--run':
+        run_one(sys.argv[2], sys.argv[3])
+        sys.exit(0)
+
+    if len(sys.argv) > 1 and sys.argv[1] in ('-h', '-help', '--help'):
+        print("Usage: ", sys.argv[0], " [OPTIONS] workdir")
+        print("""
+  workdir:    The folder in which to generate the synthetic
+              data (if it isn't there already) and write
+              the outputs of the benchmarks.
+
+  Valid OPTIONS:
+    -h, -help, --help:
+              Evidently you've already discovered this one.
+
+    -r, -rows, --rows:
+              Follow this option with the number of rows
+              in the TAKS file.  Default: 200000
+
+    -cp, -campuses, --campuses:
+              The number of schools.  Default: 1000
+
+    -s, -subjects, --subjects:
+              The number of subject columns in the TEA
+              files.  Default: 6
+
+    -y, -years, --years:
+              A comma-separated list of years.
+              Default: 2006,2007,2008
+
+    -t, -teachers, --teachers:
+              The number of teachers in each TEA file.
+              Default: 20000
+
+    -tf, -teacherfiles, --teacherfiles:
+              The number of TEA files.  Default: 4
+
+    -a, -awkward, --awkward:
+              The fraction of TAKS rows with a field that
+              needs quoting (commas, quotes, newlines).
+              Default: 0.05
+
+    -seed, --seed:
+              The random seed for the data.  Default: 1
+
+    -n, -repeat, --repeat:
+              Run each benchmark this many times and keep
+              the fastest.  Default: 3
+
+    -b, -bench, --bench:
+              A comma-separated list of the benchmarks to
+              run, out of:
+              """ + ", ".join(BENCHMARKS) + """
+              Default: all of them
+
+    -o, -out, --output:
+              Follow this option with the name of a file in
+              which to save the results, as JSON.
+
+    -c, -compare, --compare:
+              Follow this option with the name of a results
+              file saved earlier, to compare this run with.
+
+    The data is only generated if workdir doesn't already hold
+    a TAKS file made with the same settings, so that runs can be
+    compared on the same data.  Each benchmark runs in a process
+    of its own; its speed is reported in rows per second, and
+    its peak memory (resident set size) in kilobytes.
+
+    Example usage:
+
+    ./benchmark.py -r 1000000 -o before.json /tmp/bench
+    ./benchmark.py -r 1000000 -c before.json /tmp/bench
+              """)
+        sys.exit(1)
+
+    # read options
+    while len(sys.argv) > 2:
+        option = sys.argv[1]
+        del sys.argv[1]
+        try:
+            if option in ('-r', '-rows', '--rows'):
+                rows = int(sys.argv[1])
+            elif option in ('-cp', '-campuses', '--campuses'):
+                campuses = int(sys.argv[1])
+            elif option in ('-s', '-subjects', '--subjects'):
+                subjects = int(sys.argv[1])
+            elif option in ('-y', '-years', '--years'):
+                years = sys.argv[1].split(',')
+            elif option in ('-t', '-teachers', '--teachers'):
+                teachers = int(sys.argv[1])
+            elif option in ('-tf', '-teacherfiles', '--teacherfiles'):
+                teacherFiles = int(sys.argv[1])
+            elif option in ('-a', '-awkward', '--awkward'):
+                awkward = float(sys.argv[1])
+            elif option in ('-seed', '--seed'):
+                seed = int(sys.argv[1])
+            elif option in ('-n', '-repeat', '--repeat'):
+                repeat = max(1, int(sys.argv[1]))
+            elif option in ('-b', '-bench', '--bench'):
+                only = sys.argv[1].split(',')
+                for name in only:
+                    if name not in BENCHMARKS:
+                        print(sys.argv[0] + ":", 'unknown benchmark', name)
+                        print(error)
+                        sys.exit(1)
+            elif option in ('-o', '-out', '--output'):
+                outfilename = sys.argv[1]
+            elif option in ('-c', '-compare', '--compare'):
+                compare = sys.argv[1]
+            else:
+                print(sys.argv[0] + ":", 'invalid option', option)
+                print(error)
+                sys.exit(1)
+        except ValueError:
+            print(sys.argv[0] + ":", 'invalid value for', option, sys.argv[1])
+            print(error)
+            sys.exit(1)
+        del sys.argv[1]
+
+    try:
+        workdir = sys.argv[1]
+    except IndexError:
+        print("Usage:", sys.argv[0], "[options] workdir")
+        print(error)
+        sys.exit(1)
+
+    # make the data, unless it's already there
+    settings = {'rows': rows, 'campuses': campuses, 'subjects': subjects, 'years': years,
+                'teachers': teachers, 'teacherfiles': teacherFiles, 'awkward': awkward,
+                'seed': seed}
+    settingsPath = os.path.join(workdir, 'settings.json')
+    try:
+        with open(settingsPath) as sFile:
+            fresh = json.load(sFile) == settings
+    except (OSError, ValueError):
+        fresh = False
+    if not fresh:
+        print("Generating data in", workdir, "...")
+        generate(workdir, rows, campuses, subjects, years, teachers, teacherFiles, awkward, seed)
+        with open(settingsPath, 'w') as sFile:
+            json.dump(settings, sFile)
+    os.makedirs(os.path.join(workdir, 'out'), exist_ok=True)
+
+    # run each benchmark, keeping the fastest time
+    results = []
+    for name in (only or BENCHMARKS):
+        best = None
+        for i in range(repeat):
+            result = measure(name, workdir)
+            if best is None or result['seconds'] < best['seconds']:
+                peak = max(result['peak_rss_kb'], best['peak_rss_kb']) if best else result['peak_rss_kb']
+                best = result
+                best['peak_rss_kb'] = peak
+        best['name'] = name
+        best['rows_per_sec'] = best['rows'] / best['seconds'] if best['seconds'] > 0 else None
+        results.append(best)
+
+    report = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'python': platform.python_version(),
+              'platform': platform.platform(),
+              'numpy': sf.numpy.__version__ if sf.numpy is not None else None,
+              'settings': settings,
+              'results': results}
+
+    previous = {}
+    if compare is not None:
+        with open(compare) as cFile:
+            previous = {result['name']: result for result in json.load(cFile)['results']}
+
+    print("{0:<28}{1:>12}{2:>10}{3:>14}{4:>14}".format('benchmark', 'rows', 'seconds',
+                                                      'rows/sec', 'peak RSS kB'))
+    for result in results:
+        line = "{0:<28}{1:>12}{2:>10.3f}{3:>14.0f}{4:>14}".format(
+            result['name'], result['rows'], result['seconds'],
+            result['rows_per_sec'] or 0, result['peak_rss_kb'])
+        old = previous.get(result['name'])
+        if old is not None and old.get('rows_per_sec'):
+            line += "   {0:+.1%} speed".format((result['rows_per_sec'] or 0) / old['rows_per_sec'] - 1)
+        print(line)
+
+    if outfilename is not None:
+        with open(outfilename, 'w') as oFile:
+            json.dump(report, oFile, indent=1)
+        print("Results saved in", outfilename)
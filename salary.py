@@ -4,428 +4,1464 @@
 # A script to arrange data in the form teacher-salary vs. student-grades
 # or the form teacher-experience vs. student-grades
 
-import sys, os, csv
+import sys, os, re, csv, json
+import argparse, collections, hashlib
+import array
+import multiprocessing
 import FileManip as fm
 
-# open files
-# default columns to be processed
-options = []
-single = False
-year = None
-tColumn = "BASE PAY"
-sColumn = "DISTRICT CATEGORY NAME"
-dColumn = 'm_raw'
-folder = None
-folderList = None
-dheaderfilename = None
-theaderfilename = None
-outfilename = 'output_avg.txt'
-error = "Use --help option for assistance"
-
-# check for options
-if len(sys.argv) > 1:
-    if sys.argv[1] in ('-h', '-help', '--help'):
-        print("Usage: ", sys.argv[0], " [OPTIONS] teacherfile datafile")
-        print("""
-  teacherfile: The file from which you get the teacher data.
-  datafile:    The file containing the student scores.
-
-  Valid OPTIONS:
-    -h, -help, --help:
-              Evidently you've already discovered this one.
-
-    -hd, -hdata, --headerdata:
-              Follow this option with the name of the file
-              containing the column titles for TAKS data,
-              if located in a separate file.
-
-    -ht, -hteach, --headerteacher:
-              Follow this option with the name of the file
-              containing the column titles for TEA data,
-              if located in a separate file.
-
-    -t, -tcol, --tcolumn:
-              Follow this option with the name of the
-              column in the TEA files from which you wish
-              to extract data.
-
-              Default: "BASE PAY"
-
-    -sc, -scol, --scolumn:
-              Follow this option with the name of the
-              column in the TEA files from which you wish
-              to extract school data.
-
-              Default: "DISTRICT CATEGORY NAME"
-
-    -c, -col, --column:
-              Follow this option with the name of the
-              column in the TAKS file from which you wish
-              to extract data.
-
-              Default: "m_raw"
-
-    -y, -yr, --year:
-              Follow this option with the year containing
-              the data which you would like to extract
-              from the TAKS file.
-
-    -i, -indiv, --individual:
-              Use this option if you wish the program to
-              extract only data for those schools where
-              there is a single, individual Math teacher.
-              You do not need to follow this parameter
-              with anything.
-
-    -f, -fold, --folder:
-              Follow this option with the name of the
-              folder containing the TEA files from which
-              you wish to extract data.
-
-              NOTE: The files should have roughly the
-              same form, differing by index.  For example:
-              TCHM01.csv, TCHM02.csv, etc.  In this case,
-              when you pass the TEA filename as a (non-
-              optional) parameter to the program, you
-              should replace the varying elements by '*',
-              as in TCHM*.csv.  Make sure you enclose
-              this expression in quotes: 'TCHM*.csv'
-
-    Example usage (all one line):
-
-    ./teachers.py -i -y 2007 -col m_ssc -hd headers.csv -f ../data/ 'TCHM*.csv' TAKS.csv
-
-              """)
-        sys.exit(1)
 
-# read options
-while len(sys.argv) > 3:
-    option = sys.argv[1]
-    del sys.argv[1]
-    if option in ('-hd', '-hdata', '--headerdata'):
-        dheaderfilename = sys.argv[1]
-        del sys.argv[1]
-    elif option in ('-ht', '-hteach', '--headerteacher'):
-        theaderfilename = sys.argv[1]
-        del sys.argv[1]
-    elif option in ('-t', '-tcol', '--tcolumn'):
-        tColumn = sys.argv[1]
-        del sys.argv[1]
-    elif option in ('-sc', '-scol', '--scolumn'):
-        sColumn = sys.argv[1]
-        del sys.argv[1]
-    elif option in ('-c', '-col', '--column'):
-        dColumn = sys.argv[1]
-        del sys.argv[1]
-    elif option in ('-y', '-yr', '--year'):
-        year = sys.argv[1]
-        del sys.argv[1]
-    elif option in ('-f', '-fold', '--folder'):
-        folder = sys.argv[1]
-        del sys.argv[1]
-    elif option in ('-i', '-indiv', '--individual'):
-        single = True
-        outfilename = 'output_indiv.txt'
-    else:
-        print(sys.argv[0] + ":",'invalid option', option)
-        print(error)
-        sys.exit(1)
+# the kinds of value totalled for each campus
+SALARY, EXPERIENCE, SCORE = range(3)
+
+class CampusTotals:
+    """Running totals for each campus, kept in arrays indexed by campus code.
+
+    The first time a campus ID is added it is interned and given
+    the next dense integer code, 0, 1, 2, ..., so each school costs
+    a few array slots rather than a dict of lists.  For each code,
+    and each kind of value (SALARY, EXPERIENCE and SCORE), we keep
+    the number of values added and their sum and sum of squares;
+    and we keep the last label (the district code) added.
+
+    One of these holds everything we know about the teachers of
+    every school, and one the scores, and it is also what each
+    piece of the TAKS file is summed up in before being merged.
+
+    Iterating over the totals gives the campus IDs in the order they
+    were first added.
+    """
+
+    def __init__(self):
+        self.codes  = {}                # schoolID:code
+        self.ids    = []                # code:schoolID
+        self.counts = [array.array('l') for kind in range(3)]
+        self.sums   = [array.array('d') for kind in range(3)]
+        self.sumsSq = [array.array('d') for kind in range(3)]
+        self.labels = []
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __contains__(self, idnum):
+        return idnum in self.codes
+
+    def __iter__(self):
+        return iter(self.codes)
+
+    def code(self, idnum):
+        """Return the code for a campus ID, handing out a new one if need be."""
+
+        code = self.codes.get(idnum)
+        if code is None:
+            idnum = sys.intern(idnum)
+            code  = self.codes[idnum] = len(self.ids)
+            self.ids.append(idnum)
+            for counts, sums, sumsSq in zip(self.counts, self.sums, self.sumsSq):
+                counts.append(0)
+                sums.append(0.0)
+                sumsSq.append(0.0)
+            self.labels.append(None)
+        return code
+
+    def add(self, idnum, kinds, values, label=None):
+        """Add one row's values of the given kinds (and label, if any) to the totals for a campus."""
+
+        code = self.code(idnum)
+        for kind, value in zip(kinds, values):
+            self.counts[kind][code] += 1
+            self.sums[kind][code]   += value
+            self.sumsSq[kind][code] += value**2
+        if label is not None:
+            self.labels[code] = label
+
+    def count(self, idnum, kind):
+        """Return how many values of a kind have been added for a campus."""
+
+        code = self.codes.get(idnum)
+        return self.counts[kind][code] if code is not None else 0
+
+    def mean(self, idnum, kind):
+        """Return the average value of a kind for a campus, or None if there are none."""
+
+        code = self.codes.get(idnum)
+        if code is None or self.counts[kind][code] == 0:
+            return None
+        return self.sums[kind][code] / self.counts[kind][code]
+
+    def label(self, idnum):
+        """Return the last label added for a campus."""
+
+        return self.labels[self.codes[idnum]]
+
+    def merge(self, other):
+        """Add in the totals from another CampusTotals, e.g. for another piece of the TAKS file.
+
+        Totals must be merged in the order the rows were read, so
+        that the last label wins, just as it would reading all the
+        rows one after another.
+        """
+
+        for idnum, otherCode in other.codes.items():
+            code = self.code(idnum)
+            for kind in range(3):
+                self.counts[kind][code] += other.counts[kind][otherCode]
+                self.sums[kind][code]   += other.sums[kind][otherCode]
+                self.sumsSq[kind][code] += other.sumsSq[kind][otherCode]
+            if other.labels[otherCode] is not None:
+                self.labels[code] = other.labels[otherCode]
+
+    def state(self):
+        """Return the totals as plain lists, e.g. to be saved as JSON."""
+
+        live = list(self.codes.values())
+        return {'ids':    list(self.codes),
+                'counts': [[counts[code] for code in live] for counts in self.counts],
+                'sums':   [[sums[code] for code in live] for sums in self.sums],
+                'sumsSq': [[sumsSq[code] for code in live] for sumsSq in self.sumsSq],
+                'labels': [self.labels[code] for code in live]}
+
+    @classmethod
+    def from_state(cls, state):
+        """Make a CampusTotals from what state() returned."""
+
+        totals = cls()
+        for idnum in state['ids']:
+            totals.code(idnum)
+        for kind in range(3):
+            totals.counts[kind] = array.array('l', state['counts'][kind])
+            totals.sums[kind]   = array.array('d', state['sums'][kind])
+            totals.sumsSq[kind] = array.array('d', state['sumsSq'][kind])
+        totals.labels = list(state['labels'])
+        return totals
+
+    def nbytes(self):
+        """Return roughly how many bytes of memory the totals take up."""
+
+        arrays = self.counts + self.sums + self.sumsSq
+        return (sum(sys.getsizeof(values) for values in arrays)
+                + sys.getsizeof(self.codes) + sys.getsizeof(self.ids) + sys.getsizeof(self.labels)
+                + sum(sys.getsizeof(idnum) for idnum in self.ids)
+                + sum(sys.getsizeof(label) for label in set(self.labels) if label is not None))
+
+
+class CampusValues:
+    """The SALARY and EXPERIENCE of each Math teacher in one TEA file, by campus.
+
+    Sums of floats depend on the order they're added in, so the
+    totals for several files can't just be merged: that would add
+    each file's sum to the running total, not each salary.  These
+    keep every value, in file order, instead, and add_to adds them
+    to the running totals one by one, just as if the rows were
+    being read then.  Adding the values for each file in turn gives
+    the same totals, to the last digit, as reading every file one
+    after another.
+
+    For each campus, in the order it first appears, there are
+    arrays of the values and the last label (district code) seen.
+    """
+
+    def __init__(self):
+        self.campuses = {}              # schoolID:[salaries, experience, label]
+
+    def __len__(self):
+        return len(self.campuses)
+
+    def add(self, idnum, salary, experience, label):
+        """Add one teacher's values to those for a campus."""
+
+        entry = self.campuses.get(idnum)
+        if entry is None:
+            entry = self.campuses[idnum] = [array.array('d'), array.array('d'), None]
+        entry[0].append(salary)
+        entry[1].append(experience)
+        entry[2] = label
+
+    def add_to(self, totals):
+        """Add every value, in file order, to a CampusTotals."""
+
+        counts, sums, sumsSq = totals.counts, totals.sums, totals.sumsSq
+        for idnum, (salaries, experience, label) in self.campuses.items():
+            code = totals.code(idnum)
+            for kind, values in ((SALARY, salaries), (EXPERIENCE, experience)):
+                for value in values:
+                    counts[kind][code] += 1
+                    sums[kind][code]   += value
+                    sumsSq[kind][code] += value**2
+            if label is not None:
+                totals.labels[code] = label
+
+    def state(self):
+        """Return the values as plain lists, e.g. to be saved as JSON."""
+
+        return {'ids':        list(self.campuses),
+                'salaries':   [list(entry[0]) for entry in self.campuses.values()],
+                'experience': [list(entry[1]) for entry in self.campuses.values()],
+                'labels':     [entry[2] for entry in self.campuses.values()]}
+
+    @classmethod
+    def from_state(cls, state):
+        """Make a CampusValues from what state() returned."""
+
+        values = cls()
+        for idnum, salaries, experience, label in zip(state['ids'], state['salaries'],
+                                                      state['experience'], state['labels']):
+            values.campuses[idnum] = [array.array('d', salaries), array.array('d', experience), label]
+        return values
+
+
+def read_scores(rows, dFilename, campusCol, yearCol, scoreCol, year, schools=None, scores=None):
+    """Add up the scores in some rows of the TAKS file, school by school.
+
+    Returns a tuple (schools, scores, rows), where schools is a dict
+    schoolID:None holding every school ID, exactly as it appears
+    in the file, in the order it first appears, scores is a
+    CampusTotals holding the number, sum and sum of squares of the
+    SCORE values for the given year (or all years if year is None) for
+    each school, and rows is the number of rows read.
+
+    Passing in the schools and scores from an earlier call carries
+    on adding to them, just as if the rows had followed on.
+    """
+
+    if schools is None:
+        schools = {}
+    if scores is None:
+        scores = CampusTotals()
+    counts, sums, sumsSq = scores.counts[SCORE], scores.sums[SCORE], scores.sumsSq[SCORE]
+    lineCount = -1
+    for lineCount, line in enumerate(rows):                   # go through each line in student data
+        if lineCount % 1000000 == 0:
+            print("\t", lineCount, "lines read from", dFilename)
+        schools.setdefault(line[campusCol])                   # no repeats, and no search through a list
+        # If it's not the year we want (or all years)
+        # or there's no score, we're done with this line
+        # before doing any more work on it
+        if year is not None and line[yearCol].strip() != year:
+            continue
+        scoreStr = line[scoreCol].strip()
+        if scoreStr == '':
+            continue
+        thisSchool = line[campusCol].strip()                  # get student's school ID
+        thisScore  = float(scoreStr)                          # get student's Math score
+        code = scores.code(thisSchool)                        # add the score to the totals for that school
+        counts[code] += 1
+        sums[code]   += thisScore
+        sumsSq[code] += thisScore**2
+
+    return schools, scores, lineCount + 1
+
+def read_score_range(datafilename, begin, end, campusCol, yearCol, scoreCol, year):
+    """Add up the scores between two byte offsets of the TAKS file.
+
+    Like read_scores, but opens the file itself, so that it can
+    be handed to a separate process along with a range from
+    FileManip.split_csv.
+    """
+
+    dFilename = "{0} (bytes {1}-{2})".format(datafilename, begin, end)
+    rows = fm.read_csv_range(datafilename, begin, end)
+    return read_scores(rows, dFilename, campusCol, yearCol, scoreCol, year)
+
+def read_cached_scores(dCache, dColumn, year):
+    """Add up the scores in a column cache of the TAKS file, school by school.
+
+    Returns the same (schools, scores, rows) as read_scores, from a
+    FileManip.ColumnCache holding "campus" and "year" as string
+    columns and the score column as a numeric one.
+    """
+
+    # codes are handed out in order of first appearance,
+    # so the campus values are already the school IDs in order
+    campusValues = dCache.values("campus")
+    schools      = dict.fromkeys(campusValues)
+
+    # strip and check each distinct campus and year once, not once per line
+    schoolIDs = [idnum.strip() for idnum in campusValues]
+    wanted    = [year is None or thisYear.strip() == year for thisYear in dCache.values("year")]
+
+    scores = CampusTotals()
+    counts, sums, sumsSq = scores.counts[SCORE], scores.sums[SCORE], scores.sumsSq[SCORE]
+    for campusCode, yearCode, thisScore in zip(dCache.codes("campus"),
+                                               dCache.codes("year"),
+                                               dCache.numeric(dColumn)):
+        if wanted[yearCode] and thisScore == thisScore:      # a blank score is cached as NaN
+            code = scores.code(schoolIDs[campusCode])
+            counts[code] += 1
+            sums[code]   += thisScore
+            sumsSq[code] += thisScore**2
+
+    return schools, scores, len(dCache)
+
+def merge_score_totals(schools, campuses, partSchools, partScores):
+    """Fold the school IDs and score totals for part of the TAKS file into the running ones.
+
+    Parts must be merged in file order, to keep school IDs in the
+    order they first appear.
+    """
+
+    for idnum in partSchools:
+        schools.setdefault(idnum)
+    campuses.merge(partScores)
+
+def read_score_batch(rows, dFilename, campusCol, yearCol, scoreCols, years, schools=None, tables=None):
+    """Add up several score columns in some rows of the TAKS file, for several years at once.
+
+    scoreCols is a list of (column, index) pairs; years is a list
+    of years to keep apart, None for all years taken together, or
+    "all" for every year in the file, each kept apart.
+
+    Returns a tuple (schools, tables, rows), where schools and rows
+    are just as for read_scores and tables is a dict
+    (column, year):CampusTotals (year being None for all years
+    together) with the SCORE totals for each combination that has
+    any scores.  As with read_scores,
+    the schools and tables from an earlier call can be carried on.
+    """
+
+    if schools is None:
+        schools = {}
+    if tables is None:
+        tables = {}
+    wanted  = set(years) if years not in (None, "all") else None
+    lineCount = -1
+    for lineCount, line in enumerate(rows):
+        if lineCount % 1000000 == 0:
+            print("\t", lineCount, "lines read from", dFilename)
+        schools.setdefault(line[campusCol])
+        if years is None:
+            thisYear = None
+        else:
+            thisYear = line[yearCol].strip()
+            if wanted is not None and thisYear not in wanted:
+                continue
+        thisSchool = None
+        for column, scoreCol in scoreCols:
+            scoreStr = line[scoreCol].strip()
+            if scoreStr == '':
+                continue
+            if thisSchool is None:
+                thisSchool = line[campusCol].strip()
+            scores = tables.get((column, thisYear))
+            if scores is None:
+                scores = tables[(column, thisYear)] = CampusTotals()
+            thisScore = float(scoreStr)
+            code = scores.code(thisSchool)
+            scores.counts[SCORE][code] += 1
+            scores.sums[SCORE][code]   += thisScore
+            scores.sumsSq[SCORE][code] += thisScore**2
+
+    return schools, tables, lineCount + 1
+
+def read_score_batch_range(datafilename, begin, end, campusCol, yearCol, scoreCols, years):
+    """Like read_score_batch, for the rows between two byte offsets of the TAKS file."""
+
+    dFilename = "{0} (bytes {1}-{2})".format(datafilename, begin, end)
+    rows = fm.read_csv_range(datafilename, begin, end)
+    return read_score_batch(rows, dFilename, campusCol, yearCol, scoreCols, years)
+
+def read_cached_score_batch(dCache, dColumns, years):
+    """Like read_score_batch, from a column cache of the TAKS file.
+
+    Every column and year is added up in a single pass over the
+    cached columns, with each distinct campus and year stripped
+    and checked just once.
+    """
+
+    campusValues = dCache.values("campus")
+    schools      = dict.fromkeys(campusValues)
+    schoolIDs    = [idnum.strip() for idnum in campusValues]
+
+    # the year of the tables each year code's rows go in,
+    # or False if they aren't wanted
+    wanted   = set(years) if years not in (None, "all") else None
+    yearKeys = []
+    for thisYear in dCache.values("year"):
+        thisYear = thisYear.strip()
+        if years is None:
+            yearKeys.append(None)
+        elif wanted is not None and thisYear not in wanted:
+            yearKeys.append(False)
+        else:
+            yearKeys.append(thisYear)
+
+    # every table is made up front, so each year code has the list
+    # of its columns and tables at hand; empty ones are dropped after
+    tables    = {}
+    scoreCols = [(column, dCache.numeric(column)) for column in dColumns]
+    yearRows  = []
+    for thisYear in yearKeys:
+        if thisYear is False:
+            yearRows.append(None)
+        else:
+            yearRow = []
+            for column, values in scoreCols:
+                scores = tables.setdefault((column, thisYear), CampusTotals())
+                yearRow.append((values, scores.code, scores.counts[SCORE],
+                                scores.sums[SCORE], scores.sumsSq[SCORE]))
+            yearRows.append(yearRow)
+
+    for row, (campusCode, yearCode) in enumerate(zip(dCache.codes("campus"), dCache.codes("year"))):
+        yearRow = yearRows[yearCode]
+        if yearRow is None:
+            continue
+        for values, schoolCode, counts, sums, sumsSq in yearRow:
+            thisScore = values[row]
+            if thisScore != thisScore:                       # a blank score is cached as NaN
+                continue
+            code = schoolCode(schoolIDs[campusCode])
+            counts[code] += 1
+            sums[code]   += thisScore
+            sumsSq[code] += thisScore**2
+
+    tables = dict((key, scores) for key, scores in tables.items() if len(scores) > 0)
+    return schools, tables, len(dCache)
+
+def merge_score_batch(schools, tables, partSchools, partTables):
+    """Fold the results of read_score_batch for part of the TAKS file into the running ones."""
+
+    for idnum in partSchools:
+        schools.setdefault(idnum)
+    for key, partScores in partTables.items():
+        scores = tables.get(key)
+        if scores is None:
+            scores = tables[key] = CampusTotals()
+        scores.merge(partScores)
+
+def write_scores(oFile, schools, campuses, scores):
+    """Write the table for one column and year to a FileManip.RowWriter.
+
+    There is a row for each school (in the order of schools) that
+    has both a salary in campuses and a score in scores.  Returns a
+    tuple (count, countSalary, countScore, countBoth): the number of
+    rows written, and the number of schools left out for lack of a
+    salary, of a score, and of both.
+    """
+
+    # 1st column: School IDs
+    # 2nd column: District code
+    # 3rd column: avgSalary
+    # 4th column: avgExperience
+    # 5th column: avgScore
+    # The district code is written as it is, commas and all,
+    # as it always has been.
+    oFile.writerow(['school_id', 'district_code', 'avg_salary', 'avg_experience', 'avg_score'])
+
+    count       = 0
+    countSalary = 0
+    countScore  = 0
+    countBoth   = 0
+    for idnum in schools:                            # go through each school ID
+        theSalary     = campuses.mean(idnum, SALARY)
+        theExperience = campuses.mean(idnum, EXPERIENCE)
+        theScore      = scores.mean(idnum, SCORE)
+        if theSalary is None:
+            countSalary += 1
+        if theScore is None:
+            countScore += 1
+        if theSalary is None and theScore is None:
+            countBoth += 1
+        if (theSalary is not None) and (theScore is not None):
+            # if there's a salary and a score
+            # write them out
+            oFile.writerow((idnum, campuses.label(idnum), theSalary, theExperience, theScore))
+            count += 1
 
-# get file names
-try:
-    teacherfilename = sys.argv[1]
-    datafilename    = sys.argv[2]
-except:
-    print("Usage:", sys.argv[0], "[options] teacherfile datafile")
-    print(error)
-    sys.exit(1)
-
-if folder is not None:
-    folderList = os.listdir(folder)
-
-# open input file with student data
-dHeaders, dFile = fm.get_headers(datafilename, dheaderfilename)
-
-
-# get school codes, throw them all into a list or dict
-# perhaps best to just iterate through the teacher file
-# and just pluck out the schools codes.  simple as that.
-print("Getting school IDs:")
-
-schools = []
-colnum = dHeaders.index('campus')
-lineCount = 0
-for line in dFile:
-    idnum = line[colnum]
-    # ideally we should only append idnum
-    # if it's not already in schools
-    # but that implies a search through the array
-    # for every ID we add: very inefficient!  And worse as the array grows!
-    # So we'll just have to live with repeats
-    schools.append(idnum)
-    if lineCount % 1000000 == 0:
-        print("\t", lineCount, "lines read from", datafilename)
-    lineCount += 1
-
-# with the school codes in hand, now choose a subject
-# let's say Math
-
-# open the teacher file(s)
-# go through each teacher,
-# see if he teaches Math, and if so,
-# add his salary to a list associated with the school code
-# and add his experience to another list for that code
-
-# first make a list of all the teacher files
-# we want to parse
-tFilenames = []
-if folder is not None:
-    print("Getting filenames for teacher data from", folder)
-    teacherBasename, teacherExt = os.path.splitext(teacherfilename)
-    tPattern = teacherBasename.strip('*').lstrip(folder)
-    for tFilename in folderList:
-        tBasename, tExt = os.path.splitext(tFilename)
-        if tPattern in tBasename:
-            tFilenames.append(tFilename)
-            print("\t", tFilename, "added to list...")
-else:
-    tFilenames.append(teacherfilename)
-    print("Single file for teacher data:", teacherfilename)
-
-
-# make a dict of dicts to store salaries and more
-# dict to hold groups "schoolID":[array of salaries], [array of yrs experience]
-teachers = {}
-for idnum in schools:         # This is where we'll have to deal with repeats in schools
-    teachers[idnum] = {}               # For a repeat, re-initialize salaries[idnum] to {}
-    teachers[idnum]['salaries']   = [] # as well as teachers[]['salaries']
-    teachers[idnum]['experience'] = [] # etc.
-    teachers[idnum]['code']       = ''
-
-# add data from each file, file by file
-for tFilename in tFilenames:
-    tHeaders, tFile = fm.get_headers(folder + tFilename, theaderfilename)
-
-
-    subjectNames = []                    # each teacher teaches lots of subjects
-    for title in tHeaders:               # make a list of columns with subject names
-        if "SUBJECT AREA NAME" in title:
-            subjectNames.append(title)
+    return count, countSalary, countScore, countBoth
 
+def write_score_batch(oFile, schools, campuses, tables, dColumns, years):
+    """Write the long table of a batch to a FileManip.RowWriter, and return the number of rows written.
 
+    There is a row for each school (in the order of schools), year
+    and column (in the order given, or with "all", in order of year)
+    that has both a salary in campuses and a score in tables.
+    oFile should quote fields (i.e. not be plain), since district
+    codes can hold commas.
+    """
+
+    if years == "all":
+        years = sorted(set(thisYear for column, thisYear in tables))
+    elif years is None:
+        years = [None]
+    combos = [(column, thisYear) for thisYear in years for column in dColumns
+              if (column, thisYear) in tables]
+
+    oFile.writerow(['school_id', 'year', 'column', 'district_code',
+                    'avg_salary', 'avg_experience', 'avg_score'])
+
+    count = 0
+    for idnum in schools:
+        theSalary = campuses.mean(idnum, SALARY)
+        if theSalary is None:
+            continue
+        theExperience = campuses.mean(idnum, EXPERIENCE)
+        for column, thisYear in combos:
+            theScore = tables[(column, thisYear)].mean(idnum, SCORE)
+            if theScore is None:
+                continue
+            oFile.writerow((idnum, thisYear if thisYear is not None else 'all', column,
+                            campuses.label(idnum), theSalary, theExperience, theScore))
+            count += 1
+
+    return count
+
+class SubjectFilter(dict):
+    """Which subject names count as teaching the subject we want, e.g. Math.
+
+    A name counts if the regular expression "pattern" is found in
+    it, ignoring case, or if it is one of "codes" (ignoring case
+    and surrounding whitespace).  Each distinct name is only ever
+    tested once: subjects[name] looks up the answer, working it
+    out the first time a name turns up.  There are only a few
+    hundred subject names, so that's nearly always a dict lookup.
+    """
+
+    def __init__(self, pattern='math', codes=None):
+        super().__init__()
+        self.pattern = re.compile(pattern, re.IGNORECASE) if pattern is not None else None
+        self.codes   = frozenset(code.strip().upper() for code in codes) if codes else frozenset()
+
+    def __missing__(self, name):
+        wanted = (name.strip().upper() in self.codes
+                  or (self.pattern is not None and self.pattern.search(name) is not None))
+        self[name] = wanted
+        return wanted
+
+def read_teacher_file(tFilename, tPath, theaderfilename, tColumn, sColumn,
+                      subjectPattern='math', subjectCodes=None, teachers=None):
+    """Get the salaries and experience of Math teachers in one TEA file.
+
+    Returns a tuple (values, count, rows), where values is a
+    CampusValues holding, for each school in the order it first
+    appears, the SALARY and EXPERIENCE of each of its Math teachers
+    and the last district code seen for the school; count is the
+    number of Math teachers found in the file; and rows is the
+    number of rows in it.
+
+    With teachers, a CampusTotals, each Math teacher is instead
+    added straight to those running totals as the rows are read,
+    and values is None.
+
+    A Math teacher is one with a subject name that SubjectFilter
+    accepts, given subjectPattern and subjectCodes; other subjects
+    can be picked out the same way.
+
+    The arguments are plain strings so that this can be handed
+    to a separate process, one file per process.
+    """
+
+    tHeaders, tFile = fm.get_headers(tPath, theaderfilename, threaded=True)
+    tSchema = fm.HeaderSchema(tHeaders)
+
+    # each teacher teaches lots of subjects
+    # so make a list of columns with subject names
+    subjectCols = tSchema.matching("SUBJECT AREA NAME")
+
+    # and find the other columns we need, once per file
+    try:
+        schoolCol, salaryCol, experienceCol, codeCol = tSchema.require(
+            "CAMPUS NUMBER", tColumn, "EXPERIENCE", sColumn)
+    except ValueError as e:
+        raise ValueError(tFilename + ": " + str(e))
 
     print("Getting Math teachers from", tFilename)
 
+    subjects = SubjectFilter(subjectPattern, subjectCodes)
+
+    values = CampusValues() if teachers is None else None
     count = 0
     lineCount = 0
     for line in tFile:                 # look at each row in this teacher file
         teachesMath = False
-        for subject in subjectNames:   # check the columns that contain the subjects taught
-            if "math" in line[tHeaders.index(subject)].lower(): # if even one says "Math"
+        for subject in subjectCols:    # check the columns that contain the subjects taught
+            if subjects[line[subject]]:                         # if even one says "Math"
                 teachesMath = True                              # take note
                 count += 1
                 break
         if teachesMath:
-            thisSchool     = line[tHeaders.index("CAMPUS NUMBER")].strip()
-            thisSalary     = float(line[tHeaders.index(tColumn)].strip())
-            thisExperience = float(line[tHeaders.index("EXPERIENCE")].strip())
-            thisCode       = line[tHeaders.index(sColumn)].strip()
-            if thisSchool not in teachers.keys():
-                schools.append(thisSchool)
-                teachers[thisSchool] = {}
-                teachers[thisSchool]['salaries']   = []
-                teachers[thisSchool]['experience'] = []
-                teachers[thisSchool]['code']       = ''
-            teachers[thisSchool]['salaries'].append(thisSalary)
-            teachers[thisSchool]['experience'].append(thisExperience)
-            teachers[thisSchool]['code'] = thisCode
+            thisSchool     = line[schoolCol].strip()
+            thisSalary     = float(line[salaryCol].strip())
+            thisExperience = float(line[experienceCol].strip())
+            thisCode       = line[codeCol].strip()
+            if values is not None:
+                values.add(thisSchool, thisSalary, thisExperience, thisCode)
+            else:
+                teachers.add(thisSchool, (SALARY, EXPERIENCE), (thisSalary, thisExperience), thisCode)
         if lineCount % 1000000 == 0:
             print("\t", lineCount, "lines read from", tFilename)
         lineCount += 1
 
-    print("\t Found", count, "Math teachers in file", tFilename, "...")
-
-# so now we have, for each school code,
-# an associated list containing all the
-# Math teacher salaries for that code
-# and all the years of experience for
-# Math teachers for the same code
-
-# Single Teachers:
-# If we only want data for schools with one Math teacher,
-# then we should delete those keys (school IDs) where
-# the list of salaries has more than one entry
-count = 0
-killList = []              # We can't modify the dict as we loop over it
-if single:                 # so create a list of schoolIDs to kill
-    print("\nRemoving schools with more than one Math teacher...")
-    for schoolID in teachers.keys():
-        if len(teachers[schoolID]['salaries']) > 1:
-            killList.append(schoolID)
-            count += 1
-    for idnum in killList:
-        teachers.pop(idnum)
-    print("\t", count, "schools removed from data...\n")
-
-# Now the rest of the manipulations should work
-# whether there's one salary or more for each school
-
-# average those salaries and years of experience,
-# creating a dict, say, with school code as the key,
-# and average salary for Math teachers as one value
-# and the average experience as the other
-avgTeachers = {}
-countDeadbeats = 0
-for idnum in teachers.keys():
-    money      = teachers[idnum]['salaries']
-    experience = teachers[idnum]['experience']
-    code       = teachers[idnum]['code']
-
-    avgTeachers[idnum] = {}
-    avgTeachers[idnum]['salaries'] = sum(money) / len(money) if len(money) > 0 else None
-    avgTeachers[idnum]['experience'] = sum(experience) / len(experience) if len(experience) > 0 else None
-    avgTeachers[idnum]['code'] = code
-    if len(money) == 0:
-        countDeadbeats += 1
-
-# Recall that the dict 'teachers' was initialized
-# with all the schoolIDs from the TAKS data.
-# If the files used for the TEA data don't include
-# all schools, then many 'teacher' keys will be eliminated
-print(countDeadbeats, "schools omitted for lack of salary...\n")
-
-# that finishes the salary and experience part of things
-
-# now on to the scores
-
-# go through the scores file, e.g. the TAKS data
-# for each line, record the school code and the Math score
-# stick these in a dict, so that the key is the
-# school code, and the value is a list of Math scores
-# for all the students in that school
-dHeaders, dFile = fm.get_headers(datafilename, dheaderfilename)
-
-scores = {}
-for idnum in schools:      # again we'll just live with the repeats
-    scores[idnum] = []     # for a repeat, we just re-initialize scores[idnum] to []
-
-
-print("Getting", dColumn, "scores:")
-
-count = 0
-lineCount = 0
-for line in dFile:                                        # go through each line in student data
-    thisYear   = line[dHeaders.index("year")].strip()     # get the year for that score
-    thisSchool = line[dHeaders.index("campus")].strip()   # get student's school ID
-    scoreStr   = line[dHeaders.index(dColumn)].strip()
-    thisScore  = float(scoreStr) if scoreStr != '' else None # get student's Math score
-    if (thisYear == year or year is None) and (thisScore is not None):
-        # If it's the year we want (or all years)
-        # and there's a score
-        if thisSchool not in scores.keys():               # make sure that school's on the list, and
-            schools.append(thisSchool)
-            scores[thisSchool] = []
-        scores[thisSchool].append(thisScore)              # add the score to the list for that school
-    if lineCount % 1000000 == 0:
-        print("\t", lineCount, "lines read from", datafilename)
-    lineCount += 1
-    count += 1
-
-# average these scores,
-# creating a dict, with school code as key,
-# and average Math score as value
-avgScores = {}
-for idnum in scores.keys():
-    results = scores[idnum]
-    avgScores[idnum] = sum(results) / len(results) if len(results) > 0 else None
-
-# the UPSHOT:
-# we have some dicts, whose key:value pairs look roughly
-# schoolID:avgMathTeacherSalary,
-# schoolID:avgMathTeacherExperience,
-# and
-# schoolID:avgTAKSscoreForMath
-
-# create three lists, one of average salaries, another of
-# average experience, and the last of associated
-# average Math scores, linking via
-# schoolID:
-#             List 1                   List 2                       List 3
-# Element 0   salary0 -> (schoolID) -> experience0 -> (schoolID) -> score0
-# Element 1   salary1 -> (schoolID) -> experience1 -> (schoolID) -> score1
-# etc.
-
-# actually, we should pack them into a dict
-# together with the schoolID as key, so that we
-# don't lose that information
-
-finalOutput = {}
-count       = 0
-countSalary = 0
-countScore  = 0
-countBoth   = 0
-for idnum in avgTeachers.keys():                 # go through each school ID
-    theCode       = avgTeachers[idnum]['code']
-    theSalary     = avgTeachers[idnum]['salaries']
-    theExperience = avgTeachers[idnum]['experience']
-    theScore      = avgScores[idnum]
-    if theSalary is None:
-        countSalary += 1
-    if theScore is None:
-        countScore += 1
-    if theSalary is None and theScore is None:
-        countBoth += 1
-    if (theSalary is not None) and (theScore is not None):
-        # if there's a salary and a score
-        # tack them on
-        finalOutput[idnum] = {
-            'code': theCode,
-            'avgSalary': theSalary,
-            'avgExperience': theExperience,
-            'avgScore': theScore
-        }
-        count += 1
-
-print(count, "school IDs added for output...")
-print("\t", countSalary, "schools omitted for lack of salary data...")
-print("\t", countScore, "schools omitted for lack of score data...")
-print("\t", countBoth, "schools omitted for lack of salary and score data...")
-
-
-# output to file
-# 1st column: School IDs
-# 2nd column: avgSalary
-# 3rd column: avgExperience
-# 4th column: avgScore
-oFile = open("../tmp/" + outfilename, "w")
-
-titles = ''
-titles += 'school_id'
-titles += ','
-titles += 'district_code'
-titles += ','
-titles += 'avg_salary'
-titles += ','
-titles += 'avg_experience'
-titles += ','
-titles += 'avg_score'
-titles += '\n'
-
-oFile.write(titles)
-
-for idnum in finalOutput.keys():
-    outString  = idnum
-    outString += ','
-    outString += finalOutput[idnum]['code']
-    outString += ','
-    outString += str(finalOutput[idnum]['avgSalary'])
-    outString += ','
-    outString += str(finalOutput[idnum]['avgExperience'])
-    outString += ','
-    outString += str(finalOutput[idnum]['avgScore'])
-    outString += '\n'
-    oFile.write(outString)
-
-oFile.close()
-
-# done... use the output for regression, graphing, etc.
+    return values, count, lineCount
+
+
+def data_state(datafilename, end):
+    """Describe how much of the TAKS file has been read, for a checkpoint.
+
+    Returns a dict {'end', 'digest', 'complete'}: the offset read up
+    to, a digest of what was read (see FileManip.sample_digest) and
+    whether it ended with a whole row, so that rows appended later
+    can't have been run on to the end of the last one.
+    """
+
+    with open(datafilename, 'rb') as dFile:
+        dFile.seek(max(0, end - 1))
+        complete = end == 0 or dFile.read(1) == b'\n'
+    return {'end': end, 'digest': fm.sample_digest(datafilename, end), 'complete': complete}
+
+def file_state(filename):
+    """Return the size and modification time of a file, to see later whether it has changed."""
+
+    info = os.stat(filename)
+    return {'size': info.st_size, 'mtime': info.st_mtime_ns}
+
+def load_checkpoint(ckFilename, settings):
+    """Return what a checkpoint file saved, or None if there's no usable one.
+
+    A checkpoint is only used if it was saved with the same files,
+    columns and years (settings), since its totals would be no good
+    for any others.  It comes back as a dict with 'schools' (as
+    from read_scores), 'tables', a dict (column, year):CampusTotals
+    of scores, 'data', as from data_state, and 'teachers', a dict
+    filename:{'size', 'mtime', 'count', 'values'} for each TEA
+    file, values being a CampusValues.
+    """
+
+    try:
+        with open(ckFilename) as ckFile:
+            saved = json.load(ckFile)
+    except (OSError, ValueError):
+        return None
+    if saved.get('settings') != settings:
+        print("Checkpoint", ckFilename, "was saved with other settings, starting again...")
+        return None
+
+    checkpoint = {'schools': dict.fromkeys(saved['schools']),
+                  'tables':  {(column, thisYear): CampusTotals.from_state(state)
+                              for column, thisYear, state in saved['tables']},
+                  'data':    saved['data'],
+                  'teachers': {}}
+    for tFilename, entry in saved['teachers'].items():
+        if 'values' not in entry:              # saved as totals, by an older version
+            continue
+        entry = dict(entry)
+        entry['values'] = CampusValues.from_state(entry['values'])
+        checkpoint['teachers'][tFilename] = entry
+    return checkpoint
+
+def save_checkpoint(ckFilename, settings, checkpoint):
+    """Save the totals in a checkpoint (as load_checkpoint returns them) to a file.
+
+    The file is written under another name and then renamed, so a
+    run that stops part way never leaves half a checkpoint behind.
+    """
+
+    saved = {'settings': settings,
+             'schools':  list(checkpoint['schools']),
+             'tables':   [[column, thisYear, scores.state()]
+                          for (column, thisYear), scores in checkpoint['tables'].items()],
+             'data':     checkpoint['data'],
+             'teachers': {}}
+    for tFilename, entry in checkpoint['teachers'].items():
+        entry = dict(entry)
+        entry['values'] = entry['values'].state()
+        saved['teachers'][tFilename] = entry
+
+    tmpFilename = ckFilename + '.tmp'
+    with open(tmpFilename, 'w') as ckFile:
+        json.dump(saved, ckFile)
+    os.replace(tmpFilename, ckFilename)
+
+
+# how much memory a TeacherCache may use for values, by default (bytes)
+TEACHER_CACHE_BYTES = 256 << 20
+
+class TeacherCache:
+    """The teacher totals for sets of TEA files already read, kept to be used again.
+
+    Each entry holds the CampusTotals that load_teachers returned
+    for a list of TEA files, with the number of Math teachers found
+    in each, under a key made from every file's path, size and
+    modification time, in order, and the settings they were read
+    with (header file, columns and subject).  So a set of files in
+    which any file changes, or is added, or that is read with other
+    settings, is simply a new key, and a hit is exactly what reading
+    the files again would give.  The single-teacher filter is
+    applied after the totals are added up, without changing them,
+    so it isn't part of the key.
+
+    Entries are kept in memory, least recently used first, and the
+    least recently used are dropped to keep the total size (as
+    CampusTotals.nbytes gives it) within maxbytes.  With a dirname
+    each entry is saved there too, as JSON, and an entry that isn't
+    in memory is loaded from there if it can be; so the cache lasts
+    from one run, or process, to the next.  A list of files read
+    with the same settings has a single file in the directory,
+    whatever their sizes and times, so new versions of the TEA
+    files replace the entry for the old ones; and the least
+    recently used files are removed to keep the directory within
+    maxbytes as well.
+
+    A long-lived program can keep one of these and hand it to run
+    (or load_teachers) for every query; the TEA files are then
+    only read again when they change.
+    """
+
+    def __init__(self, maxbytes=TEACHER_CACHE_BYTES, dirname=None):
+        self.maxbytes = maxbytes
+        self.dirname  = dirname
+        self.entries  = collections.OrderedDict()  # key:(teachers, counts, nbytes)
+        self.nbytes   = 0
+        self.hits     = 0
+        self.misses   = 0
+        if dirname is not None:
+            os.makedirs(dirname, exist_ok=True)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def key(self, tFiles, settings):
+        """Return the key for a list of (name, path) of TEA files as they are now, read with some settings."""
+
+        tStates = []
+        for tFilename, tPath in tFiles:
+            info = os.stat(tPath)
+            tStates.append([os.path.abspath(tPath), info.st_size, info.st_mtime_ns])
+        return json.dumps([tStates] + list(settings))
+
+    def _filename(self, key):
+        # named for the paths and settings only, leaving out the sizes
+        # and times, so each new version of the files replaces the last
+        where    = json.loads(key)
+        where[0] = [tPath for tPath, size, mtime in where[0]]
+        return os.path.join(self.dirname, hashlib.sha1(json.dumps(where).encode()).hexdigest() + '.json')
+
+    def _touch(self, key):
+        try:
+            os.utime(self._filename(key))
+        except OSError:
+            pass
+
+    def _prune(self, keep):
+        # drop the least recently used files (the oldest modification
+        # times) until the directory is within maxbytes again
+        saved = []
+        for cFilename in os.listdir(self.dirname):
+            if cFilename.endswith('.json'):
+                cFilename = os.path.join(self.dirname, cFilename)
+                try:
+                    info = os.stat(cFilename)
+                except OSError:
+                    continue
+                saved.append((info.st_mtime_ns, info.st_size, cFilename))
+        total = sum(size for mtime, size, cFilename in saved)
+        for mtime, size, cFilename in sorted(saved):
+            if total <= self.maxbytes:
+                break
+            if cFilename == keep:
+                continue
+            try:
+                os.remove(cFilename)
+            except OSError:
+                pass
+            total -= size
+
+    def _keep(self, key, teachers, counts):
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.nbytes -= old[2]
+        size = teachers.nbytes()
+        if size > self.maxbytes:
+            return
+        self.entries[key] = (teachers, counts, size)
+        self.nbytes += size
+        while self.nbytes > self.maxbytes:
+            oldKey, (oldTeachers, oldCounts, oldSize) = self.entries.popitem(last=False)
+            self.nbytes -= oldSize
+
+    def get(self, key):
+        """Return the (teachers, counts) kept under a key, or None if there are none."""
+
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            if self.dirname is not None:
+                self._touch(key)
+            self.hits += 1
+            return entry[0], entry[1]
+        if self.dirname is not None:
+            try:
+                with open(self._filename(key)) as cFile:
+                    saved = json.load(cFile)
+            except (OSError, ValueError):
+                saved = None
+            if saved is not None and saved.get('key') == key and 'totals' in saved:
+                teachers = CampusTotals.from_state(saved['totals'])
+                self._keep(key, teachers, saved['counts'])
+                self._touch(key)
+                self.hits += 1
+                return teachers, saved['counts']
+        self.misses += 1
+        return None
+
+    def put(self, key, teachers, counts):
+        """Keep the totals and teacher counts for a key (saving them, if there's a directory)."""
+
+        self._keep(key, teachers, counts)
+        if self.dirname is not None:
+            cFilename = self._filename(key)
+            tmpFilename = cFilename + '.tmp'
+            with open(tmpFilename, 'w') as cFile:
+                json.dump({'key': key, 'counts': counts, 'totals': teachers.state()}, cFile)
+            os.replace(tmpFilename, cFilename)
+            self._prune(cFilename)
+
+
+
+
+# The stages of a run, one function each, so that they can be
+# used from other programs as well as from the command line:
+#
+#     tFiles = find_teacher_files('TCHM*.csv', '../data/')
+#     teachers, tResults = load_teachers(tFiles)
+#     schools, tables, rows, size = load_scores('TAKS.csv', ['m_raw'], ['2007'])
+#     schools = join_schools(schools, teachers)
+#     schools, removed = filter_single(schools, teachers)      # if need be
+#     with fm.RowWriter('output_avg.txt', plain=True) as oFile:
+#         write_scores(oFile, schools, teachers, tables[('m_raw', '2007')])
+#
+# The teacher totals are never changed by the later stages, so a
+# long-lived program can load the TEA files once and keep them,
+# joining them with as many score files, columns and years as it
+# likes (see run), or hand a TeacherCache to load_teachers, which
+# then reads the TEA files again only when they change.  Anything
+# using jobs > 1 must, as always with multiprocessing, be started
+# under 'if __name__ == "__main__":'.
+
+def score_settings(dColumns=(), years=()):
+    """Tidy up the score columns and years asked for, and say whether they make a batch.
+
+    Returns a tuple (dColumns, years, batch).  Repeats are dropped,
+    and no columns at all means "m_raw".  One column and at most
+    one year is the usual run; anything more (or "all" years) is a
+    batch, with years a list, "all", or None for all years taken
+    together.  Outside a batch, years is a list of at most one year.
+    Tidying them twice changes nothing.
+    """
+
+    dColumns = list(dict.fromkeys(dColumns or ())) or ['m_raw']
+    if years == "all" or (years and "all" in years):
+        years = "all"
+    else:
+        years = list(dict.fromkeys(years or ()))
+    batch = len(dColumns) > 1 or years == "all" or len(years) > 1
+    if batch and not years:
+        years = None
+    return dColumns, years, batch
+
+def load_scores(datafilename, dColumns=(), years=(), dheaderfilename=None,
+                jobs=1, cache=False, checkpoint=None):
+    """Add up the scores in the TAKS file for the columns and years asked for.
+
+    Returns a tuple (schools, tables, rows, size), where schools is
+    a dict schoolID:None of every school ID in the file, as for
+    read_scores; tables is a dict (column, year):CampusTotals of
+    the SCORE totals, as for read_score_batch (outside a batch, it
+    has just the one entry, for the column and year, or None, asked
+    for); rows is the number of rows read and size the number of
+    bytes read (None if they came from the cache).  The columns and
+    years are tidied up by score_settings.
+
+    With jobs > 1 the file is cut into that many pieces of whole
+    rows, each read by its own process (unless it is compressed);
+    with cache = True it is read through a FileManip.ColumnCache.
+    checkpoint is a dict as load_checkpoint returns it (or one with
+    empty 'schools', 'tables' and 'teachers'): the rows it covers
+    are not read again, and it is updated to cover the whole file.
+
+    Raises a ValueError, naming the file, if a column is missing or
+    a score isn't a number.
+    """
+
+    dColumns, years, batch = score_settings(dColumns, years)
+    year = years[0] if not batch and years else None
+    dCompressed = fm.compression(datafilename) is not None
+    if checkpoint is not None and dCompressed:
+        raise ValueError(datafilename + ": a checkpoint needs an uncompressed TAKS file")
+    sequential = checkpoint is None and not cache and (jobs <= 1 or dCompressed)
+
+    # go through the scores file, e.g. the TAKS data, just once.
+    # For each line, record the school code (so we know every
+    # school in the order it first appears) and, if the line has
+    # a score for the year we want, fold that score into running
+    # totals for the school.  We never need the individual scores,
+    # only how many there are, their sum and their sum of squares,
+    # so memory only grows with the number of schools.
+    print("Getting school IDs and", ", ".join(dColumns), "scores:")
+
+    # if it's read straight through, the file (which may be
+    # compressed) is decompressed in a thread of its own,
+    # alongside the parsing
+    dHeaders, dFile = fm.get_headers(datafilename, dheaderfilename, threaded=sequential)
+
+    # find the columns we need once, rather than on every line
+    try:
+        campusCol, yearCol, *dCols = fm.HeaderSchema(dHeaders).require("campus", "year", *dColumns)
+    except ValueError as e:
+        raise ValueError(datafilename + ": " + str(e))
+
+    # with a checkpoint, carry on from the totals saved last time,
+    # reading only the rows added to the TAKS file since then
+    size = None
+    if checkpoint is not None:
+        dEnd   = os.path.getsize(datafilename)
+        dBegin = fm.data_start(datafilename, dheaderfilename)
+        dSaved = checkpoint.get('data')
+        if dSaved is not None:
+            if (dSaved['end'] > dEnd
+                or (dSaved['end'] < dEnd and not dSaved['complete'])
+                or fm.sample_digest(datafilename, dSaved['end']) != dSaved['digest']):
+                print("\t", datafilename, "has changed since the checkpoint, reading it all again...")
+                checkpoint['schools'] = {}
+                checkpoint['tables']  = {}
+            else:
+                dBegin = dSaved['end']
+                print("\t", dEnd - dBegin, "new bytes in", datafilename, "since the checkpoint...")
+        checkpoint['data'] = data_state(datafilename, dEnd)
+        size = dEnd - dBegin
+    elif not cache:
+        size = os.path.getsize(datafilename)
+
+    # the TAKS file can be cut into byte ranges of whole rows
+    # and each range handed to its own process; the totals for
+    # the ranges are then merged in file order
+    # or, with a column cache, the CSV file needn't be parsed at all
+    scoreCols = list(zip(dColumns, dCols))
+    try:
+        if checkpoint is not None:
+            rows = fm.read_csv_range(datafilename, dBegin, dEnd)
+            if batch:
+                dResults = [read_score_batch(rows, datafilename, campusCol, yearCol, scoreCols, years,
+                                             checkpoint['schools'], checkpoint['tables'])]
+            else:
+                dResults = [read_scores(rows, datafilename, campusCol, yearCol, dCols[0], year,
+                                        checkpoint['schools'],
+                                        checkpoint['tables'].get((dColumns[0], year)))]
+                checkpoint['tables'] = {(dColumns[0], year): dResults[0][1]}
+        elif cache:
+            with fm.get_column_cache(datafilename, dheaderfilename,
+                                     numeric=dColumns, strings=["campus", "year"]) as dCache:
+                if batch:
+                    dResults = [read_cached_score_batch(dCache, dColumns, years)]
+                else:
+                    dResults = [read_cached_scores(dCache, dColumns[0], year)]
+        elif not sequential:
+            dRanges = fm.split_csv(datafilename, jobs, dheaderfilename)
+            if batch:
+                dArgs = [(datafilename, begin, end, campusCol, yearCol, scoreCols, years)
+                         for begin, end in dRanges]
+                with multiprocessing.Pool(len(dArgs)) as pool:
+                    dResults = pool.starmap(read_score_batch_range, dArgs)
+            else:
+                dArgs = [(datafilename, begin, end, campusCol, yearCol, dCols[0], year)
+                         for begin, end in dRanges]
+                with multiprocessing.Pool(len(dArgs)) as pool:
+                    dResults = pool.starmap(read_score_range, dArgs)
+        elif batch:
+            dResults = [read_score_batch(dFile, datafilename, campusCol, yearCol, scoreCols, years)]
+        else:
+            dResults = [read_scores(dFile, datafilename, campusCol, yearCol, dCols[0], year)]
+    except ValueError as e:
+        raise ValueError(datafilename + ": " + str(e))
+
+    schools = {}               # schoolID:None, i.e. an ordered set of school IDs
+    tables  = {}               # (column, year):CampusTotals of scores
+    scores  = CampusTotals()   # count, sum and sum of squares of scores, by school
+    rows    = 0
+    for partSchools, partScores, partRows in dResults:
+        if batch:
+            merge_score_batch(schools, tables, partSchools, partScores)
+        else:
+            merge_score_totals(schools, scores, partSchools, partScores)
+        rows += partRows
+    if not batch:
+        tables[(dColumns[0], year)] = scores
+
+    return schools, tables, rows, size
+
+def find_teacher_files(teacherfilename, folder=None):
+    """Return a list of (name, path) for each TEA file to be read.
+
+    Without a folder, that's just teacherfilename.  With one, it's
+    every file in the folder whose name contains teacherfilename,
+    less its extension and any '*'s, e.g. TCHM01.csv, TCHM02.csv,
+    ... for 'TCHM*.csv'.
+    """
+
+    tFiles = []
+    if folder is not None:
+        print("Getting filenames for teacher data from", folder)
+        teacherBasename, teacherExt = os.path.splitext(teacherfilename)
+        tPattern = teacherBasename.strip('*').lstrip(folder)
+        for tFilename in os.listdir(folder):
+            tBasename, tExt = os.path.splitext(tFilename)
+            if tPattern in tBasename:
+                tFiles.append((tFilename, os.path.join(folder, tFilename)))
+                print("\t", tFilename, "added to list...")
+    else:
+        tFiles.append((teacherfilename, teacherfilename))
+        print("Single file for teacher data:", teacherfilename)
+    return tFiles
+
+def load_teachers(tFiles, theaderfilename=None, tColumn="BASE PAY", sColumn="DISTRICT CATEGORY NAME",
+                  subjectPattern='math', subjectCodes=None, jobs=1, saved=None, keep=False, cache=None):
+    """Add up the salaries and experience of Math teachers in several TEA files.
+
+    tFiles is a list of (name, path), as from find_teacher_files.
+    Returns a tuple (teachers, results), where teachers is a
+    CampusTotals with the totals for all the files together, and
+    results a list with the (values, count, rows) of each file in
+    turn, as from read_teacher_file (whose arguments these are).
+
+    With jobs > 1 the files are handed out to a pool of processes.
+    saved is a dict name:(values, count, rows) of values already in
+    hand, e.g. from a checkpoint, for files that needn't be read
+    again.  Otherwise, files read here add each teacher straight to
+    the totals, and their values are None, unless keep = True.
+    Either way every salary is added to the totals in the order
+    the files were listed, so the totals are just the same as if
+    every file had been read, one after another.
+
+    cache is a TeacherCache holding the totals for lists of files
+    read before.  If it holds them for these files, as they are
+    now, with these settings, no file is read at all, and each
+    file's values and rows are None and 0; the totals found are
+    added to it otherwise.  With keep = True the values of each
+    file are wanted, so the cache is only added to.
+    """
+
+    if cache is not None:
+        tKey = cache.key(tFiles, [theaderfilename, tColumn, sColumn, subjectPattern, subjectCodes])
+        entry = None if keep else cache.get(tKey)
+        if entry is not None:
+            teachers, counts = entry
+            for (tFilename, tPath), count in zip(tFiles, counts):
+                print("\t Using cached totals for", tFilename, "...")
+                print("\t Found", count, "Math teachers in file", tFilename, "...")
+            return teachers, [(None, count, 0) for count in counts]
+
+    if saved is None:
+        saved = {}
+    tArgs = {tFilename: (tFilename, tPath, theaderfilename, tColumn, sColumn,
+                         subjectPattern, subjectCodes)
+             for tFilename, tPath in tFiles if tFilename not in saved}
+    tRead = {}
+    if jobs > 1 and len(tArgs) > 1:
+        with multiprocessing.Pool(min(jobs, len(tArgs))) as pool:
+            tRead = dict(zip(tArgs, pool.starmap(read_teacher_file, tArgs.values())))
+
+    # the running totals, by school: count, sum (and sum of squares)
+    # of salaries and of yrs experience, and the district code
+    teachers = CampusTotals()
+    results  = []
+    for tFilename, tPath in tFiles:
+        if tFilename in saved:
+            result = saved[tFilename]
+        elif tFilename in tRead:
+            result = tRead[tFilename]
+        elif keep:
+            result = read_teacher_file(*tArgs[tFilename])
+        else:
+            result = read_teacher_file(*tArgs[tFilename], teachers=teachers)
+        values, count, rows = result
+        if values is not None:
+            values.add_to(teachers)
+        print("\t Found", count, "Math teachers in file", tFilename, "...")
+        results.append(result)
+
+    if cache is not None:
+        cache.put(tKey, teachers, [count for values, count, rows in results])
+    return teachers, results
+
+def join_schools(schools, teachers):
+    """Return the schools to write out: schools, and then those with Math teachers but no scores.
+
+    Schools with Math teachers that never showed up in the TAKS data
+    still count as schools, after all those that did, in the order
+    they turned up in teachers.  schools itself isn't changed.
+    """
+
+    joined = dict(schools)
+    for idnum in teachers:
+        if teachers.count(idnum, SALARY) > 0:
+            joined.setdefault(idnum)
+    return joined
+
+def filter_single(schools, teachers):
+    """Return a tuple (schools, removed): the schools with no more than one Math teacher, and how many had more.
+
+    Neither schools nor teachers is changed, so the same teachers
+    can be used again for a run that keeps every school.
+    """
+
+    kept = {idnum: None for idnum in schools if teachers.count(idnum, SALARY) <= 1}
+    return kept, len(schools) - len(kept)
+
+
+def run(args, teachers=None, cache=None):
+    """Do everything asked for by the options in args (as from parse_args), and return the output filename.
+
+    teachers, if given, is a CampusTotals from load_teachers (for
+    the same TEA files, columns and subject) to use instead of
+    reading the TEA files again, so that a long-lived program can
+    keep them and call run for one score file, column or year after
+    another.  A checkpoint then only covers the TAKS file.
+
+    Or cache, a TeacherCache, can be handed to every run instead,
+    and is passed on to load_teachers: if it holds the totals for
+    the TEA files as they are, none is read again, and otherwise the
+    totals found are added to it.  Without one, a cache is only used
+    if args asks for one (--teachercache).
+
+    Raises a ValueError if a file lacks a column it should have or
+    has a value that isn't a number.
+    """
+
+    dColumns, years, batch = score_settings(args.columns, args.years)
+    outfilename = 'output_indiv.txt' if args.individual else 'output_avg.txt'
+    if batch:
+        outfilename = os.path.splitext(outfilename)[0] + '_long.txt'
+
+    # Math, unless we're told otherwise
+    subjectPattern = args.subject
+    if subjectPattern is None and not args.subjectcodes:
+        subjectPattern = 'math'
+
+    # stage timings, if they're wanted
+    reportfilename = args.report
+    if args.profile and reportfilename is None:
+        reportfilename = os.path.join(args.outdir, 'report.json')
+    report = fm.StageReport(enabled=reportfilename is not None, profile=args.profile)
+    with report:
+        if cache is None and args.teachercache is not None:
+            cache = TeacherCache(args.teachercachemb << 20, args.teachercache)
+
+        # first make a list of all the teacher files
+        # we want to parse, so a bad folder shows up straight away
+        if teachers is None:
+            tFiles = find_teacher_files(args.teacherfile, args.folder)
+
+        checkpoint = None
+        if args.checkpoint is not None:
+            settings = {'datafile': os.path.abspath(args.datafile),
+                        'headerdata': args.headerdata, 'headerteacher': args.headerteacher,
+                        'folder': args.folder, 'tcolumn': args.tcolumn, 'scolumn': args.scolumn,
+                        'subject': subjectPattern, 'subjectcodes': args.subjectcodes,
+                        'columns': dColumns, 'years': years}
+            checkpoint = (load_checkpoint(args.checkpoint, settings)
+                          or {'schools': {}, 'tables': {}, 'teachers': {}})
+
+        with report.stage("scores") as stage:
+            schools, tables, stage['rows'], stage['bytes'] = load_scores(
+                args.datafile, dColumns, years, args.headerdata,
+                args.jobs, args.cache, checkpoint)
+
+        # with the school codes in hand, now choose a subject
+        # let's say Math
+
+        # open the teacher file(s)
+        # go through each teacher,
+        # see if he teaches Math, and if so,
+        # add his salary to running totals for the school code
+        # and add his experience to other totals for that code
+        if teachers is None:
+            with report.stage("teachers") as stage:
+                # With a checkpoint, the values saved for a file are used
+                # again if the file hasn't changed since
+                tSaved = {}
+                if checkpoint is not None:
+                    for tFilename, tPath in tFiles:
+                        entry = checkpoint['teachers'].get(tFilename)
+                        tState = file_state(tPath)
+                        if entry is not None and (entry['size'], entry['mtime']) == (tState['size'], tState['mtime']):
+                            tSaved[tFilename] = (entry['values'], entry['count'], 0)
+                            print("\t Using checkpoint values for", tFilename, "...")
+
+                # the values of each file are only kept if they're to be saved,
+                # and with a cache that holds these files, none is read at all
+                teachers, tResults = load_teachers(tFiles, args.headerteacher, args.tcolumn, args.scolumn,
+                                                   subjectPattern, args.subjectcodes, args.jobs, tSaved,
+                                                   keep=checkpoint is not None, cache=cache)
+
+                if checkpoint is not None:
+                    checkpoint['teachers'] = {}
+                    for (tFilename, tPath), (values, count, rows) in zip(tFiles, tResults):
+                        entry = file_state(tPath)
+                        entry['count']  = count
+                        entry['values'] = values
+                        checkpoint['teachers'][tFilename] = entry
+
+                stage['rows']  = sum(rows for values, count, rows in tResults)
+                stage['bytes'] = sum(os.path.getsize(tPath) for (tFilename, tPath), (values, count, rows)
+                                     in zip(tFiles, tResults) if rows > 0)
+
+        if checkpoint is not None:
+            save_checkpoint(args.checkpoint, settings, checkpoint)
+
+        # so now we have, for each school code,
+        # the number of Math teachers for that code,
+        # the total (and total squared) of their salaries
+        # and of their years of experience
+
+        with report.stage("join") as stage:
+            scores  = None if batch else tables[(dColumns[0], years[0] if years else None)]
+            schools = join_schools(schools, teachers)
+
+            # Single Teachers:
+            # If we only want data for schools with one Math teacher,
+            # then we should leave out those school IDs where
+            # more than one salary was counted
+            if args.individual:
+                print("\nRemoving schools with more than one Math teacher...")
+                schools, count = filter_single(schools, teachers)
+                print("\t", count, "schools removed from data...\n")
+
+            # Every school ID in the TAKS data that has no Math
+            # teachers in the TEA data is omitted from the output
+            countDeadbeats = sum(1 for idnum in schools if teachers.count(idnum, SALARY) == 0)
+            print(countDeadbeats, "schools omitted for lack of salary...\n")
+            stage['rows'] = len(schools)
+
+        with report.stage("output") as stage:
+            outpath = os.path.join(args.outdir, outfilename)
+            # the usual table is written as it always has been, district
+            # codes, commas and all, unquoted; the long table of a batch
+            # is proper CSV, quoted where need be
+            with fm.RowWriter(outpath, args.floatformat, plain=not batch, lineterminator='\n') as oFile:
+                if batch:
+                    # in a batch, every school, year and column with
+                    # a salary and a score gets a row of one long table
+                    count = write_score_batch(oFile, schools, teachers, tables, dColumns, years)
+                    print(count, "rows added for output...")
+                else:
+                    # the UPSHOT:
+                    # for each schoolID we have totals from which to get
+                    # avgMathTeacherSalary,
+                    # avgMathTeacherExperience,
+                    # and
+                    # avgTAKSscoreForMath
+                    # so we can join them up as we write them out
+                    count, countSalary, countScore, countBoth = write_scores(oFile, schools, teachers, scores)
+                    print(count, "school IDs added for output...")
+                    print("\t", countSalary, "schools omitted for lack of salary data...")
+                    print("\t", countScore, "schools omitted for lack of score data...")
+                    print("\t", countBoth, "schools omitted for lack of salary and score data...")
+            stage['rows'] = count
+
+        # how long each stage took, and so on
+        if report.enabled:
+            report.save(reportfilename)
+            print()
+            for line in report.summary():
+                print(line)
+            print("Stage report saved in", reportfilename)
+
+        return outpath
+
+
+def _positive_int(text):
+    try:
+        value = int(text)
+    except ValueError:
+        value = 0
+    if value < 1:
+        raise argparse.ArgumentTypeError("number of jobs must be a positive integer")
+    return value
+
+def _megabytes(text):
+    try:
+        value = int(text)
+    except ValueError:
+        value = 0
+    if value < 1:
+        raise argparse.ArgumentTypeError("size in MB must be a positive integer")
+    return value
+
+def _subject_pattern(text):
+    try:
+        re.compile(text)
+    except re.error as e:
+        raise argparse.ArgumentTypeError("invalid subject pattern {0}: {1}".format(text, e))
+    return text
+
+def _subject_codes(text):
+    return [code for code in text.split(',') if code.strip()]
+
+def _float_format(text):
+    try:
+        format(0.0, text)
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid float format " + text)
+    return text
+
+def parse_args(argv=None):
+    """Parse the command line options (sys.argv[1:] unless argv is given) for run."""
+
+    parser = argparse.ArgumentParser(
+        add_help=False, allow_abbrev=False,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description="Arrange data in the form teacher-salary (and -experience) vs. student-grades.",
+        epilog="""
+COMPRESSED FILES:
+  The TAKS and TEA files (and header files) may be compressed with
+  gzip, bz2, xz or zstd (zstd needs the zstandard package); they are
+  read as they are decompressed, never decompressed to disk.
+
+BATCH MODE:
+  With more than one column or year, or with "-y all", every
+  combination of column and year is added up in a single pass
+  through each file, and written to one long table,
+  output_avg_long.txt (or output_indiv_long.txt with --individual),
+  with a row for each school, year and column that has both a
+  salary and a score:
+
+    school_id,year,column,district_code,avg_salary,avg_experience,avg_score
+
+  The year is "all" for scores of all years taken together, when
+  no year is given.  Unlike the usual output, this is standard
+  CSV: a district code with a comma in it is quoted.
+
+Example usage (all one line):
+
+  ./salary.py -i -y 2007 -col m_ssc -hd headers.csv -f ../data/ 'TCHM*.csv' TAKS.csv
+""")
+    parser.add_argument('teacherfile',
+                        help="The file from which you get the teacher data.")
+    parser.add_argument('datafile',
+                        help="The file containing the student scores.")
+    parser.add_argument('-h', '-help', '--help', action='help',
+                        help="Evidently you've already discovered this one.")
+    parser.add_argument('-hd', '-hdata', '--headerdata', metavar='FILE',
+                        help="The file containing the column titles for TAKS data, "
+                             "if located in a separate file.")
+    parser.add_argument('-ht', '-hteach', '--headerteacher', metavar='FILE',
+                        help="The file containing the column titles for TEA data, "
+                             "if located in a separate file.")
+    parser.add_argument('-t', '-tcol', '--tcolumn', metavar='COLUMN', default="BASE PAY",
+                        help='The column in the TEA files from which to extract data. '
+                             'Default: "BASE PAY"')
+    parser.add_argument('-sc', '-scol', '--scolumn', metavar='COLUMN', default="DISTRICT CATEGORY NAME",
+                        help='The column in the TEA files from which to extract school data. '
+                             'Default: "DISTRICT CATEGORY NAME"')
+    parser.add_argument('-c', '-col', '--column', dest='columns', metavar='COLUMN',
+                        action='append', default=[],
+                        help='The column in the TAKS file from which to extract data. '
+                             'Give it more than once to extract several columns in one '
+                             'pass (see BATCH MODE below). Default: "m_raw"')
+    parser.add_argument('-y', '-yr', '--year', dest='years', metavar='YEAR',
+                        action='append', default=[],
+                        help='The year of the data to extract from the TAKS file. '
+                             'Give it more than once for several years, or give "all" '
+                             'for every year in the file, each kept apart (see BATCH '
+                             'MODE below).')
+    parser.add_argument('-i', '-indiv', '--individual', action='store_true',
+                        help="Only extract data for those schools where there is a "
+                             "single, individual Math teacher.")
+    parser.add_argument('-f', '-fold', '--folder', metavar='FOLDER',
+                        help="The folder containing the TEA files. The files should have "
+                             "roughly the same form, differing by index, e.g. TCHM01.csv, "
+                             "TCHM02.csv, etc.; give the teacherfile with the varying "
+                             "part replaced by '*', in quotes: 'TCHM*.csv'")
+    parser.add_argument('-j', '-jobs', '--jobs', metavar='N', type=_positive_int, default=1,
+                        help="The number of processes to use for reading the TEA files, "
+                             "one file per process at a time, and for reading the TAKS "
+                             "file, which is cut into that many pieces of whole rows "
+                             "(unless it is compressed).  The TEA results are the same "
+                             "whatever the number of processes; the sum of the scores "
+                             "for a school may be added up piece by piece, which for "
+                             "scores that aren't whole numbers can change the last digit "
+                             "of its average. Default: 1")
+    parser.add_argument('-ca', '-cache', '--cache', action='store_true',
+                        help="Read the TAKS file through a typed, column-by-column cache "
+                             "kept next to it (in a directory named after the file, plus "
+                             "'.cols').  The first run builds the cache, or adds any "
+                             "columns it lacks; later runs read only the cached columns "
+                             "they need.  The cache is rebuilt if the TAKS file changes.  "
+                             "--jobs is not used for the TAKS file in this case.")
+    parser.add_argument('-subj', '-subject', '--subject', metavar='PATTERN', type=_subject_pattern,
+                        help='A regular expression for the subject taught: a teacher '
+                             'counts if it is found, ignoring case, in any of the '
+                             'teacher\'s "SUBJECT AREA NAME" columns. Default: "math"')
+    parser.add_argument('-codes', '-subjectcodes', '--subjectcodes', metavar='CODES',
+                        type=_subject_codes,
+                        help="A comma-separated list of subject names (or codes) to count "
+                             "exactly, ignoring case and surrounding spaces.  Given on its "
+                             "own, only these are counted; with --subject as well, a "
+                             "teacher counts if either matches.")
+    parser.add_argument('-o', '-out', '--outdir', metavar='FOLDER', default='../tmp/',
+                        help='The folder in which to write the output file.  The file is '
+                             'written under a temporary name and only renamed once it is '
+                             'complete. Default: "../tmp/"')
+    parser.add_argument('-ff', '-floatformat', '--floatformat', metavar='SPEC', type=_float_format,
+                        help='A Python format spec for the averages written out, e.g. ".6f" '
+                             'for six decimal places.  By default they are written in full, '
+                             'as str() gives them.')
+    parser.add_argument('-rp', '-report', '--report', metavar='FILE',
+                        help="A file in which to save a report (as JSON) of each stage of "
+                             "the run: reading the scores, reading the teachers, joining "
+                             "them up and writing them out, with the wall-clock and CPU "
+                             "time, the rows read (and rows per second), the bytes read, "
+                             "and the peak memory so far.  A summary is printed at the "
+                             "end, too.")
+    parser.add_argument('-p', '-profile', '--profile', action='store_true',
+                        help="Run each stage under cProfile and tracemalloc as well, "
+                             "adding the functions that took the most time, and the peak "
+                             "memory Python allocated, to the stage report (saved in "
+                             "report.json in the output folder, unless you use --report).  "
+                             "This makes the run much slower.  Processes started by --jobs "
+                             "aren't profiled.")
+    parser.add_argument('-k', '-checkpoint', '--checkpoint', metavar='FILE',
+                        help="A file in which to keep the totals for every school, along "
+                             "with how much of the TAKS file and which TEA files they "
+                             "cover.  The next run with the same files, columns and years "
+                             "reads only the rows appended to the TAKS file since, and "
+                             "only new (or changed) TEA files, and gives the same results "
+                             "as reading everything again.  If the part of the TAKS file "
+                             "already read has changed, or the file is shorter, it is "
+                             "read again from the start.  Whether it has changed is "
+                             "judged from a digest of all of it, up to 16 MB, or beyond "
+                             "that of 256 blocks of 64 kB spread evenly over it: a change "
+                             "in the middle of a bigger file that keeps its length, and "
+                             "misses every block, goes unnoticed, so start afresh (delete "
+                             "the checkpoint) after editing rows in place.  The TAKS file "
+                             "is read by one process, without the cache, in this case.")
+    parser.add_argument('-tc', '-teachercache', '--teachercache', metavar='FOLDER',
+                        help="A folder in which to keep the teacher totals for each campus "
+                             "from the TEA files read, for the files as they are and the "
+                             "columns and subject they were read with.  Later runs, "
+                             "whatever the TAKS file, columns or years, use them instead "
+                             "of reading the files again, until any of them changes.  New "
+                             "versions of the files replace the totals kept for the old "
+                             "ones, and the least recently used are removed to keep the "
+                             "folder within --teachercachemb.  Delete the folder to clear "
+                             "it.  With --checkpoint, which keeps the values of each "
+                             "file itself, the folder is only added to.")
+    parser.add_argument('-tcm', '-teachercachemb', '--teachercachemb', metavar='MB', type=_megabytes,
+                        default=TEACHER_CACHE_BYTES >> 20,
+                        help="How much the teacher cache may keep, in megabytes: the totals "
+                             "held in memory, and separately the files in the "
+                             "--teachercache folder, are each kept within this. "
+                             "Default: {0}".format(TEACHER_CACHE_BYTES >> 20))
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    try:
+        run(parse_args(argv))
+    except ValueError as e:
+        print(sys.argv[0] + ":", e)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
+
+    # done... use the output for regression, graphing, etc.
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3.1
+
+# test_FileManip.py
+# Checks that the fast extract_fields splits lines exactly as
+# the original, character-by-character parser does.
+# Run with "python -m unittest test_FileManip" (or pytest).
+
+import random
+import unittest
+import FileManip as fm
+
+
+# lines from TAKS and TEA files, and the awkward cases
+# the quote rules have to get right
+EDGE_CASES = [
+    '',
+    '\n',
+    '\r\n',
+    ',',
+    ',,\n',
+    'a,b,c',
+    'a,b,c\n',
+    'a,b,\n',
+    'a,,c\r\n',
+    '"sid","campus","year","m_raw","m_ssc"\n',
+    '1001, 101912001 ,2007,38,2203\n',
+    '1002,101912001,2007,,\n',
+    '7,"Suburban, small",MATHEMATICS,ALGEBRA I\n',
+    "7,'Suburban, small',MATHEMATICS,ALGEBRA I\n",
+    '7, 101912001 ,51234.5,12,"Major urban",MATHEMATICS,,ENGLISH\n',
+    '"say ""hi""",x\n',
+    'say "hi",x\n',
+    '"it\'s",x\n',
+    '\'say "hi"\',x\n',
+    '"a, b",\'c, d\',e\n',
+    '"unclosed, quote\n',
+    "'unclosed, quote\n",
+    'mid"dle, quote",x\n',
+    '"quoted"after,x\n',
+    '"line\nbreak",x\n',
+    '"spaced ", " out"\n',
+    '"a"\r\n',
+]
+
+
+def random_line(rand):
+    """Return a random line of quotes, commas, letters and line endings."""
+
+    chars  = ['"', "'", ',', 'a', 'b', ' ', '\n', '\r']
+    weight = [3, 2, 4, 6, 3, 2, 1, 1]
+    line   = ''.join(rand.choices(chars, weight, k=rand.randint(0, 30)))
+    return line + rand.choice(['', '\n', '\r\n'])
+
+
+class ExtractFieldsTest(unittest.TestCase):
+
+    def check(self, line):
+        self.assertEqual(fm.extract_fields(line), fm._extract_fields_by_char(line), repr(line))
+        self.assertEqual(fm._extract_fields_by_quote(line), fm._extract_fields_by_char(line), repr(line))
+
+    def test_edge_cases(self):
+        for line in EDGE_CASES:
+            self.check(line)
+
+    def test_random_lines(self):
+        rand = random.Random(2024)
+        for i in range(50000):
+            self.check(random_line(rand))
+
+    def test_field_too_big_for_csv(self):
+        # the csv module refuses fields over csv.field_size_limit()
+        self.check('"' + 'a' * 200000 + '",b\n')
+        self.check("'" + 'a' * 200000 + "',b\n")
+
+
+if __name__ == "__main__":
+    unittest.main()